@@ -0,0 +1,38 @@
+# Cost of ack handling and enqueueing in robust2 with many QoS 1 messages in flight, before
+# (scanning msg_to_confirm, kept in bench/baseline) and after the pid -> key index.
+#
+# python bench/bench_acks.py
+import time
+import common
+from umqtt import robust2
+from umqtt_baseline import robust2 as baseline
+
+
+def run(module, n):
+    client = common.attach(module.MQTTClient("pico-e66141040333222a", "broker"))
+    client.MSG_QUEUE_MAX = 2 * n + 10
+    for i in range(n):
+        client.publish("pico-e66141040333222a/event/%d" % i, "m", qos=1)
+    start = time.perf_counter()
+    for i in range(n):
+        client.add_msg_to_send(("pico-e66141040333222a/queued", "m", False, 1))
+    enqueue = (time.perf_counter() - start) / n
+    # Acks in reverse order, the worst case for a scan that starts at the oldest entry
+    start = time.perf_counter()
+    for pid in range(n, 0, -1):
+        client.cbstat(pid, 1)
+    ack = (time.perf_counter() - start) / n
+    return enqueue * 1e6, ack * 1e6
+
+
+def main():
+    rows = []
+    for n in (100, 1000):
+        before = run(baseline, n)
+        after = run(robust2, n)
+        rows.append("%9d %15.1f %14.1f %11.1f %10.1f" % (n, before[0], after[0], before[1], after[1]))
+    common.report("robust2 ack handling, us per operation", rows, "%9s %15s %14s %11s %10s" % ("in-flight", "enqueue before", "enqueue after", "ack before", "ack after"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Packets per second and peak bytes allocated per packet for the umqtt.codec encoders and
+# decoders, without any socket.
+#
+# python bench/bench_codec.py
+import common
+from umqtt import codec
+
+N = 20000
+buf = bytearray(256)
+TOPIC = "pico-e66141040333222a/state"
+PAYLOAD = b'{"caldera_temp": 21.50, "casa_temp": 20.25, "caldera_status": true}'
+
+
+def packet(encode):
+    n = encode()
+    return bytes(buf[:n])
+
+
+def decoder(raw, parse):
+    mv = memoryview(raw)
+
+    def run():
+        flags, length, offset = codec.header(raw)
+        return parse(flags, mv[offset:offset + length])
+    return run
+
+
+PUBLISH0 = packet(lambda: codec.publish(buf, TOPIC, PAYLOAD))
+PUBLISH1 = packet(lambda: codec.publish(buf, TOPIC, PAYLOAD, False, 1, False, 17))
+PUBACK = packet(lambda: codec.puback(buf, 17))
+SUBACK = bytes((codec.SUBACK, 3, 0, 17, 0))
+CONNACK = bytes((codec.CONNACK, 2, 0, 0))
+PINGRESP = bytes((codec.PINGRESP, 0))
+
+CASES = (
+    ("CONNECT", "encode", lambda: codec.connect(buf, "pico-e66141040333222a", True, 1800, "user", "password", "pico-e66141040333222a/system/status", "offline", 0, True)),
+    ("PUBLISH QoS0", "encode", lambda: codec.publish(buf, TOPIC, PAYLOAD)),
+    ("PUBLISH QoS1", "encode", lambda: codec.publish(buf, TOPIC, PAYLOAD, False, 1, False, 17)),
+    ("SUBSCRIBE", "encode", lambda: codec.subscribe(buf, "pico-e66141040333222a/switch/toggle/caldera", 0, 17)),
+    ("PUBACK", "encode", lambda: codec.puback(buf, 17)),
+    ("CONNACK", "decode", decoder(CONNACK, lambda flags, body: codec.parse_connack(body))),
+    ("PUBLISH QoS0", "decode", decoder(PUBLISH0, codec.parse_publish)),
+    ("PUBLISH QoS1", "decode", decoder(PUBLISH1, codec.parse_publish)),
+    ("PUBACK", "decode", decoder(PUBACK, lambda flags, body: codec.parse_pid(body))),
+    ("SUBACK", "decode", decoder(SUBACK, lambda flags, body: codec.parse_suback(body))),
+    ("PINGRESP", "decode", decoder(PINGRESP, lambda flags, body: flags)),
+)
+
+
+def main():
+    rows = []
+    for name, direction, fn in CASES:
+        rate, allocated = common.measure(fn, N)
+        rows.append("%-14s %-7s %12.0f %10d" % (name, direction, rate, allocated))
+    common.report("umqtt.codec", rows, "%-14s %-7s %12s %10s" % ("packet", "", "packets/s", "bytes"))
+
+
+if __name__ == "__main__":
+    main()
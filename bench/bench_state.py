@@ -0,0 +1,39 @@
+# Speed and peak bytes allocated per call of the state serializer against building a dict
+# and calling json.dumps, for the 13 keys of the climate project.
+#
+# python bench/bench_state.py
+import json
+import common
+from makerlab.mlstate import StateEncoder
+
+KEYS = ("caldera_temp", "casa_temp", "exterior_temp", "deposito_temp", "caldera_status", "acs_status", "primerod_status",
+        "garaje_status", "gen1_status", "gen2_status", "gen3_status", "gen4_status", "mltemp_connection")
+VALUES = (21.5, 20.25, -3.0, 55.12, True, False, True, False, False, True, False, True, True)
+
+encoder = StateEncoder(KEYS)
+
+
+def with_json():
+    state = {}
+    for i in range(len(KEYS)):
+        state[KEYS[i]] = VALUES[i]
+    return json.dumps(state)
+
+
+def with_encoder():
+    values = encoder.values
+    for i in range(len(VALUES)):
+        values[i] = VALUES[i]
+    return encoder.encode()
+
+
+def main():
+    rows = []
+    for name, fn in (("dict + json.dumps", with_json), ("StateEncoder", with_encoder)):
+        rate, allocated = common.measure(fn)
+        rows.append("%-18s %10.1f %8d %8d" % (name, 1e6 / rate, allocated, len(fn())))
+    common.report("State serialization", rows, "%-18s %10s %8s %8s" % ("", "us/call", "bytes", "length"))
+
+
+if __name__ == "__main__":
+    main()
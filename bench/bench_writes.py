@@ -0,0 +1,44 @@
+# Socket writes and poll() calls per outgoing packet, before (the original umqtt.simple2,
+# kept in bench/baseline) and after single-buffer packet assembly. Every write is its own
+# TCP segment on the Pico's CYW43 stack, and every write is preceded by a poll().
+#
+# python bench/bench_writes.py
+import common
+from umqtt import simple2
+from umqtt_baseline import simple2 as baseline
+
+TOPIC = "pico-e66141040333222a/state"
+PAYLOAD = b'{"caldera_temp": 21.50, "casa_temp": 20.25, "caldera_status": true}'
+
+CASES = (
+    ("CONNECT", lambda c: c.connect()),
+    ("PUBLISH QoS0", lambda c: c.publish(TOPIC, PAYLOAD)),
+    ("PUBLISH QoS1", lambda c: c.publish(TOPIC, PAYLOAD, qos=1)),
+    ("SUBSCRIBE", lambda c: c.subscribe("pico-e66141040333222a/switch/toggle/caldera")),
+    ("PINGREQ", lambda c: c.ping()),
+)
+
+
+def count(module, action):
+    common.fake_network(module)
+    client = module.MQTTClient("pico-e66141040333222a", "broker", user="user", password="password", keepalive=1800)
+    client.set_last_will("pico-e66141040333222a/system/status", "offline", retain=True)
+    client.set_callback(lambda topic, msg, retained, duplicate: None)
+    client.connect()
+    if action is not CASES[0][1]:
+        client.sock.writes = 0
+        client.poller_w.polls = 0
+    action(client)
+    return client.sock.writes, client.poller_w.polls
+
+
+def main():
+    rows = []
+    for name, action in CASES:
+        before = count(baseline, action)
+        after = count(simple2, action)
+        rows.append("%-14s %14d %14d %13d %13d" % (name, before[0], before[0] + before[1], after[0], after[0] + after[1]))
+    common.report("Socket calls per packet (calls = writes + polls)", rows, "%-14s %14s %14s %13s %13s" % ("packet", "writes before", "calls before", "writes after", "calls after"))
+
+if __name__ == "__main__":
+    main()
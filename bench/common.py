@@ -0,0 +1,117 @@
+# Shared setup for the benchmarks. Puts the CPython shims (utime, usocket, ...) and lib/ on
+# the path, and provides a socket stand-in that counts writes instead of sending them.
+import os
+import sys
+import time
+import tracemalloc
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(_HERE, "shims"), os.path.join(_HERE, "baseline"), os.path.join(_HERE, "..", "lib")]
+
+
+class CountingSocket:
+    def __init__(self):
+        self.writes = 0
+        self.sent = 0
+        self.inq = bytearray()
+
+    def write(self, data, length=-1):
+        n = len(data) if length < 0 else length
+        self.writes += 1
+        self.sent += n
+        return n
+
+    def readinto(self, mv):
+        if not self.inq:
+            return None
+        n = min(len(mv), len(self.inq))
+        mv[:n] = self.inq[:n]
+        del self.inq[:n]
+        return n
+
+    def read(self, n):
+        if not self.inq:
+            return None
+        data = bytes(self.inq[:n])
+        del self.inq[:n]
+        return data
+
+    def close(self):
+        pass
+
+
+class CountingPoller:
+    def __init__(self):
+        self.polls = 0
+
+    def poll(self, timeout=-1):
+        self.polls += 1
+        return [(None, 4)]
+
+    def register(self, *args):
+        pass
+
+    def unregister(self, *args):
+        pass
+
+
+# Replaces the socket and select modules a client module imported, so that connect() gets
+# a counting socket that answers with CONNACK right away
+class _FakeSocketModule:
+    @staticmethod
+    def getaddrinfo(host, port):
+        return [(0, 0, 0, "", (host, port))]
+
+    @staticmethod
+    def socket(*args):
+        sock = CountingSocket()
+        sock.inq += b"\x20\x02\x00\x00"
+        sock.setblocking = lambda flag: None
+        sock.connect = lambda address: None
+        return sock
+
+
+class _FakeSelectModule:
+    POLLIN = 1
+    POLLOUT = 4
+    POLLERR = 8
+    POLLHUP = 16
+    poll = CountingPoller
+
+
+def fake_network(module):
+    module.socket = _FakeSocketModule
+    module.uselect = _FakeSelectModule
+
+
+# Attaches a counting socket and pollers to an MQTTClient as if it were connected
+def attach(client):
+    client.sock = CountingSocket()
+    client.poller_r = CountingPoller()
+    client.poller_w = CountingPoller()
+    client.cb = lambda topic, msg, retained, duplicate: None
+    return client
+
+
+# Runs fn n times, returns (calls per second, peak bytes allocated by one call)
+def measure(fn, n=20000):
+    fn()
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    rate = n / (time.perf_counter() - start)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    fn()
+    allocated = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return rate, allocated
+
+
+def report(title, rows, header):
+    print(title)
+    print("  " + header)
+    for row in rows:
+        print("  " + row)
+    print()
@@ -0,0 +1,8 @@
+# Runs every benchmark, python bench/run_all.py
+import bench_codec
+import bench_writes
+import bench_acks
+import bench_state
+
+for bench in (bench_codec, bench_writes, bench_acks, bench_state):
+    bench.main()
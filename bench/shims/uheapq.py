@@ -0,0 +1 @@
+from heapq import *
@@ -0,0 +1,28 @@
+# CPython stand-in for MicroPython's utime. ticks wrap at 2**30 like on the RP2040.
+# Setting _now[0] freezes ticks_ms() at that value, tests use it to drive the clock.
+import time as _time
+
+TICKS_PERIOD = 1 << 30
+_now = [None]
+
+
+def ticks_ms():
+    if _now[0] is None:
+        return int(_time.monotonic() * 1000) & (TICKS_PERIOD - 1)
+    return _now[0] & (TICKS_PERIOD - 1)
+
+
+def ticks_us():
+    return int(_time.monotonic() * 1000000) & (TICKS_PERIOD - 1)
+
+
+def ticks_add(a, b):
+    return (a + b) & (TICKS_PERIOD - 1)
+
+
+def ticks_diff(a, b):
+    return ((a - b + (TICKS_PERIOD >> 1)) & (TICKS_PERIOD - 1)) - (TICKS_PERIOD >> 1)
+
+
+def sleep_ms(ms):
+    _time.sleep(ms / 1000)
@@ -1,7 +1,9 @@
 from secrets import wifi_SSID, wifi_password, mqtt_server, mqtt_port, mqtt_user, mqtt_password
 from makerlab.mlha import MLHA 
+from makerlab.mlsched import Scheduler
+from makerlab.mlinput import InputEvents
+import machine
 from machine import Pin
-import time
 import gc
 
 # Pins definition ===================================
@@ -31,17 +33,14 @@ def parse_message():
 
     return extracted_data
 
-def button_pressed(pin):
-    # Disable interrupt to avoid multiple presses
-    push_button.irq(trigger=Pin.IRQ_RISING, handler=None)
+# Runs in the main loop, the interrupt only records the edge and the press is debounced
+def button_pressed():
     print("Button pressed")
     if led.value() == 0:
         led.value(1)
     else:
         led.value(0)
     read_and_publish()
-    time.sleep_ms(500)
-    push_button.irq(trigger=Pin.IRQ_RISING, handler=button_pressed)
 
 def read_and_publish():
     mlha.publish_status(parse_message())
@@ -60,12 +59,13 @@ mlha.set_enable_temp_sensor(True)
 
 # Initialize led
 print("Initializing led")
-relay_caldera = Pin(led_pin, Pin.OUT)
+led = Pin(led_pin, Pin.OUT)
 
 # Initialise push button and its interrupt
 print("Initializing push button")
 push_button = Pin(button_pin, Pin.IN, Pin.PULL_DOWN)
-push_button.irq(trigger=Pin.IRQ_RISING, handler=button_pressed)
+inputs = InputEvents()
+inputs.button(push_button, on_press=button_pressed)
 
 # Subscribe to topics
 print("New session being set up")
@@ -82,16 +82,16 @@ print("Ready to send/receive data")
 mlha.publish("system/status", "online", retain=True)
 
 # Main loop
-last_update = 0
-while True:
-    try:
-        mlha.check_mqtt_msg()
-        # Send data to broker every 30 seconds
-        if time.ticks_diff(time.ticks_ms(), last_update) > 30000: # 30 seconds
-            last_update = time.ticks_ms()
-            read_and_publish()
-            mlha.update_temp_sensor()
-        time.sleep_ms(250)
-    except Exception as ex:
-        print("error: " + str(ex))
-        machine.reset()
+def publish_all():
+    read_and_publish()
+    mlha.update_temp_sensor()
+
+# Send data to broker every 30 seconds, the scheduler sleeps until then or until a message arrives
+sched = Scheduler(mlha)
+inputs.schedule(sched)
+sched.every(30000, publish_all)
+try:
+    sched.run()
+except Exception as ex:
+    print("error: " + str(ex))
+    machine.reset()
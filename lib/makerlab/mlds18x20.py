@@ -0,0 +1,132 @@
+import onewire, ds18x20
+from machine import Pin
+from time import ticks_ms, ticks_diff
+
+# Conversion time and configuration register for 9, 10, 11 and 12 bit resolution
+_CONVERSION_MS = (94, 188, 375, 750)
+_CONFIG = (0x1F, 0x3F, 0x5F, 0x7F)
+
+
+class _Bus:
+    __slots__ = ("ds", "roms", "probes")
+
+    def __init__(self, pin):
+        self.ds = ds18x20.DS18X20(onewire.OneWire(Pin(pin) if isinstance(pin, int) else pin))
+        self.roms = None # ROM ids found by the last scan, None until the bus is (re)scanned
+        self.probes = []
+
+
+class Probe:
+    __slots__ = ("bus", "index", "resolution", "rom", "value", "pending", "errors")
+
+    def __init__(self, bus, index, resolution):
+        self.bus = bus
+        self.index = index # Position of the sensor in the scan of its bus
+        self.resolution = resolution
+        self.rom = None
+        self.value = None # Last reading, None if the last conversion could not be read
+        self.pending = False
+        self.errors = 0
+
+
+# Reads DS18B20 sensors on any number of 1-Wire buses without blocking. start() broadcasts a
+# conversion to every sensor on every bus at once (skip ROM) and returns, poll() reads each
+# sensor once its own conversion time has passed. ROM ids are cached after the first scan and
+# a bus is only scanned again after a read on it failed.
+#
+# temperatures = DS18B20Engine()
+# casa = temperatures.add(21)
+# motor = temperatures.add(22, resolution=9) # ~94 ms instead of ~750 ms
+# temperatures.start()
+# ... in the main loop:
+# if temperatures.poll():
+#     print(casa.value, motor.value)
+class DS18B20Engine:
+    def __init__(self):
+        self.buses = {} # pin (GPIO number or Pin object, as given to add) -> _Bus
+        self.started = 0
+        self.busy = False
+        self.scans = 0
+        self.errors = 0
+
+    # Registers the index-th sensor found on the bus connected to pin, a GPIO number or a Pin
+    def add(self, pin, index=0, resolution=12):
+        if not 9 <= resolution <= 12:
+            raise ValueError("resolution must be 9 to 12 bits")
+        bus = self.buses.get(pin)
+        if bus is None:
+            bus = self.buses[pin] = _Bus(pin)
+        probe = Probe(bus, index, resolution)
+        bus.probes.append(probe)
+        return probe
+
+    def _scan(self, bus):
+        self.scans += 1
+        bus.roms = bus.ds.scan()
+        for probe in bus.probes:
+            probe.rom = bus.roms[probe.index] if probe.index < len(bus.roms) else None
+            if probe.rom is not None and probe.resolution != 12:
+                # Alarm registers are not used, only the configuration byte matters
+                bus.ds.write_scratch(probe.rom, bytes((0, 0, _CONFIG[probe.resolution - 9])))
+
+    def _fail(self, probe):
+        probe.value = None
+        probe.errors += 1
+        self.errors += 1
+        probe.bus.roms = None
+
+    def start(self):
+        for bus in self.buses.values():
+            try:
+                if bus.roms is None:
+                    self._scan(bus)
+                bus.ds.convert_temp()
+            except Exception as e:
+                print("1-Wire bus error: " + str(e))
+                bus.roms = None
+                for probe in bus.probes:
+                    self._fail(probe)
+                continue
+            for probe in bus.probes:
+                if probe.rom is None:
+                    self._fail(probe)
+                else:
+                    probe.pending = True
+        self.started = ticks_ms()
+        self.busy = True
+
+    # Collects the readings whose conversion is done, returns True when the last one of the cycle was read
+    def poll(self):
+        if not self.busy:
+            return False
+        elapsed = ticks_diff(ticks_ms(), self.started)
+        done = True
+        for bus in self.buses.values():
+            for probe in bus.probes:
+                if not probe.pending:
+                    continue
+                if elapsed < _CONVERSION_MS[probe.resolution - 9]:
+                    done = False
+                    continue
+                probe.pending = False
+                try:
+                    probe.value = bus.ds.read_temp(probe.rom)
+                except Exception as e:
+                    print("1-Wire read error: " + str(e))
+                    self._fail(probe)
+        self.busy = not done
+        return done
+
+    # Milliseconds until poll() has something to collect, 0 if nothing is pending
+    def time_left(self):
+        if not self.busy:
+            return 0
+        elapsed = ticks_diff(ticks_ms(), self.started)
+        left = 0
+        for bus in self.buses.values():
+            for probe in bus.probes:
+                if probe.pending:
+                    wait = _CONVERSION_MS[probe.resolution - 9] - elapsed
+                    if wait > 0 and (not left or wait < left):
+                        left = wait
+        return left
@@ -0,0 +1,85 @@
+# Entities bound to a key of the device's JSON state message. Each one publishes its own
+# discovery config, subscribes to its command topic if it has one and writes its value into
+# MLHA's shared state array (the values of the state encoder) when the state is published,
+# so a board can declare dozens of them without a global, a subscription and an if branch each.
+#
+# relay = Switch(mlha, "caldera_status", "Estado de la caldera", Pin(13, Pin.OUT), active_low=True)
+# Sensor(mlha, "casa_temp", "Temperatura de Casa", read_casa, "temperature", "C", "measurement")
+# BinarySensor(mlha, "door", "Puerta", Pin(5, Pin.IN), "door")
+
+
+def _reader(source):
+    # Pins are read through their value() method, anything else must be callable
+    if source is None or callable(source) and not hasattr(source, "value"):
+        return source
+    return source.value
+
+
+class Entity:
+    __slots__ = ("mlha", "key", "slot", "read")
+
+    def __init__(self, mlha, key, name, device_type, source=None, device_class=None, unit_of_measurement=None, state_class=None, expire_after=60):
+        self.mlha = mlha
+        self.key = key
+        self.read = _reader(source)
+        mlha.publish_config(key, name, device_type, device_class, unit_of_measurement, state_class, expire_after=expire_after)
+        self.slot = mlha.state.index[key]
+        mlha.add_entity(self)
+
+    def get(self):
+        return self.mlha.state.values[self.slot]
+
+    def set(self, value):
+        self.mlha.state.values[self.slot] = value
+
+    # Called by publish_status() before the state is serialized
+    def export(self):
+        if self.read is not None:
+            self.set(self.read())
+
+
+class Sensor(Entity):
+    __slots__ = ()
+
+    def __init__(self, mlha, key, name, source=None, device_class=None, unit_of_measurement=None, state_class=None, expire_after=60):
+        super().__init__(mlha, key, name, "sensor", source, device_class, unit_of_measurement, state_class, expire_after)
+
+
+class BinarySensor(Entity):
+    __slots__ = ("invert",)
+
+    def __init__(self, mlha, key, name, source=None, device_class=None, invert=False, expire_after=60):
+        self.invert = invert
+        super().__init__(mlha, key, name, "binary_sensor", source, device_class, expire_after=expire_after)
+
+    def export(self):
+        if self.read is not None:
+            self.set(bool(self.read()) != self.invert)
+
+
+class Switch(Entity):
+    __slots__ = ("pin", "active_low")
+
+    def __init__(self, mlha, key, name, pin, active_low=False, expire_after=60):
+        self.pin = pin
+        self.active_low = active_low
+        pin.value(1 if active_low else 0)
+        super().__init__(mlha, key, name, "switch", None, expire_after=expire_after)
+        mlha.route("switch/toggle/" + key, self.command)
+
+    def is_on(self):
+        return (self.pin.value() == 0) == self.active_low
+
+    def turn(self, on):
+        self.pin.value(0 if bool(on) == self.active_low else 1)
+
+    def command(self, topic, msg, retained, duplicate):
+        if msg == b"True":
+            self.turn(True)
+        elif msg == b"False":
+            self.turn(False)
+        # Report the new state right away
+        self.mlha.publish_status()
+
+    def export(self):
+        self.set(self.is_on())
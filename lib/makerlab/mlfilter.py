@@ -0,0 +1,150 @@
+from array import array
+
+# Filter stages for sensor readings. Every stage is called with a value and returns the value
+# to pass on, or None to reject the reading. Stages keep their history in arrays allocated
+# once, so filtering does not grow the heap.
+#
+# caldera = Pipeline(Reject(85.0), Range(0, 100), Median(3), Deadband(0.25))
+# value = caldera(reading) # None if the reading was rejected
+
+
+class Range:
+    __slots__ = ("low", "high")
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+
+    def __call__(self, value):
+        if value < self.low or value > self.high:
+            return None
+        return value
+
+
+# Rejects well known bogus readings, such as the 85.0 a DS18B20 reports before its first conversion
+class Reject:
+    __slots__ = ("values",)
+
+    def __init__(self, *values):
+        self.values = values
+
+    def __call__(self, value):
+        if value in self.values:
+            return None
+        return value
+
+
+class Median:
+    __slots__ = ("ring", "sorted", "count", "pos")
+
+    def __init__(self, n=5):
+        self.ring = array("f", [0] * n)
+        self.sorted = array("f", [0] * n) # Scratch space for sorting
+        self.count = 0
+        self.pos = 0
+
+    def __call__(self, value):
+        ring = self.ring
+        ring[self.pos] = value
+        self.pos = (self.pos + 1) % len(ring)
+        if self.count < len(ring):
+            self.count += 1
+        # Insertion sort, n is small
+        s = self.sorted
+        n = self.count
+        for i in range(n):
+            v = ring[i]
+            j = i
+            while j and s[j - 1] > v:
+                s[j] = s[j - 1]
+                j -= 1
+            s[j] = v
+        if n & 1:
+            return s[n >> 1]
+        return (s[(n >> 1) - 1] + s[n >> 1]) / 2
+
+
+class MovingAverage:
+    __slots__ = ("ring", "count", "pos", "total")
+
+    def __init__(self, n=8):
+        self.ring = array("f", [0] * n)
+        self.count = 0
+        self.pos = 0
+        self.total = 0.0
+
+    def __call__(self, value):
+        ring = self.ring
+        if self.count < len(ring):
+            self.count += 1
+        else:
+            self.total -= ring[self.pos]
+        ring[self.pos] = value
+        self.total += value
+        self.pos = (self.pos + 1) % len(ring)
+        return self.total / self.count
+
+
+# Exponential moving average, alpha is the weight of the new reading
+class EMA:
+    __slots__ = ("alpha", "value")
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.value = None
+
+    def __call__(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+
+# Holds the output until the input moves more than delta away from it
+class Deadband:
+    __slots__ = ("delta", "value")
+
+    def __init__(self, delta):
+        self.delta = delta
+        self.value = None
+
+    def __call__(self, value):
+        if self.value is None or abs(value - self.value) >= self.delta:
+            self.value = value
+        return self.value
+
+
+class Pipeline:
+    __slots__ = ("stages", "value", "rejected")
+
+    def __init__(self, *stages):
+        self.stages = stages
+        self.value = None # Last value that made it through every stage
+        self.rejected = 0
+
+    def __call__(self, value):
+        if value is None:
+            return None
+        for stage in self.stages:
+            value = stage(value)
+            if value is None:
+                self.rejected += 1
+                return None
+        self.value = value
+        return value
+
+
+# Averages several conversions per read, a drop in replacement for an ADC object
+class OversampledADC:
+    __slots__ = ("adc", "samples")
+
+    def __init__(self, adc, samples=16):
+        self.adc = adc
+        self.samples = samples
+
+    def read_u16(self):
+        total = 0
+        for _ in range(self.samples):
+            total += self.adc.read_u16()
+        return total // self.samples
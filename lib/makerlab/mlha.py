@@ -1,13 +1,40 @@
 import json
 import ubinascii
+import uhashlib
 import network
 from umqtt.robust2 import MQTTClient
 import machine
 from machine import Timer, Pin, ADC
 import time
+import random
+from makerlab.mlqueue import FlashQueue
+from makerlab.mlstate import StateEncoder
+from makerlab.mlrouter import TopicRouter
+from makerlab.mlfilter import Pipeline, Median, EMA, Deadband, OversampledADC
+from makerlab.mlprofile import BootProfiler
+
+# States of the connection, see maintain_connection()
+_CONNECTED = 0
+_BACKOFF = 1 # Waiting for the next reconnect attempt
+_WIFI = 2 # Waiting for the Wi-Fi link to come back
 
 class MLHA:
-    def __init__(self, wifi_ssid, wifi_password, mqtt_server, mqtt_port=1883, mqtt_user=None, mqtt_password=None, mqtt_keepalive=1800):
+    # Hashes of the retained discovery payloads already on the broker, kept across resets
+    CONFIG_HASHES_FILE = "/mlha_discovery.json"
+    # Access point of the last successful connection, used by fast boot
+    WIFI_CACHE_FILE = "/mlha_wifi.json"
+    # Reconnect backoff in ms, doubled after every failed attempt
+    RECONNECT_BASE = 1000
+    RECONNECT_MAX = 60000
+    # Failed attempts before the Wi-Fi link is restarted and before the Pico is reset
+    WIFI_RECOVER_AFTER = 3
+    RESET_AFTER = 10
+    WIFI_TIMEOUT = 20000
+
+    def __init__(self, wifi_ssid, wifi_password, mqtt_server, mqtt_port=1883, mqtt_user=None, mqtt_password=None, mqtt_keepalive=1800, persist_dir=None, persistent_session=False, fast_boot=False, static_ip=None):
+        # Time of each boot phase since reset, published once by publish_boot_profile()
+        self.boot = BootProfiler()
+        self.boot.mark("init")
         self.wifi_ssid = wifi_ssid
         self.wifi_password = wifi_password
         self.mqtt_server = mqtt_server
@@ -15,29 +42,99 @@ class MLHA:
         self.mqtt_user = mqtt_user
         self.mqtt_password = mqtt_password
         self.mqtt_keepalive = mqtt_keepalive
+        # Keep the broker session across resets, the client id is derived from the board id so it never changes
+        self.persistent_session = persistent_session
+        self.session_present = False
+        # Fast boot skips the LED check after a warm reset, connects to the cached access point
+        # and sends the first state before the discovery messages
+        self.fast_boot = fast_boot
+        self.static_ip = static_ip # (ip, subnet, gateway, dns) to skip DHCP
+        self.wifi_cache = None
+        self.pending_configs = [] # Discovery deferred by fast boot or a full in-flight window, see flush_discovery()
+        self.first_state_ms = None # ms from reset to the first state message
         
         self.pico_id = "pico-" + ubinascii.hexlify(machine.unique_id()).decode()
         self.led = Pin("LED", Pin.OUT)
         self.wlan = network.WLAN(network.STA_IF)
-        self.mqtt = MQTTClient(self.pico_id, mqtt_server, mqtt_port, mqtt_user, mqtt_password, keepalive=mqtt_keepalive)
+        self.mqtt = self.create_mqtt_client()
+        self.topic_state = self.pico_id + "/state"
+        self.topic_availability = self.pico_id + "/system/status"
 
         self.device_name = "ML HA Generic Device"
+        self.discovery_cache = None # (availability, device, serialized blocks), rebuilt on every connection
+        self.config_hashes = self.load_config_hashes()
+        self.config_hashes_dirty = False
+        self.pending_hashes = {} # config topic -> (payload, digest) until the broker acknowledges it
+        # Device discovery: entities are collected and sent as a single homeassistant/device/<id>/config message
+        self.device_discovery = False
+        self.components = {}
+        self.components_dirty = False
+        # Delta state publishing, see publish_status()
+        self.state_keys = [] # Keys of the JSON state message, in the order they are serialized
+        self.state = None # StateEncoder compiled from state_keys
+        self.state_precision = 2
+        self.entities = [] # makerlab.mlentity objects, exported into the state before it is published
+        self.state_sent = False
+        self.last_state_ms = 0
+        self.pending_state = False # A change is waiting for the minimum interval to pass or for the connection
+        self.state_min_interval = 0
+        self.state_heartbeat = 0 # Half of the smallest expire_after of the entities reading /state, in ms
+        self.availability_sent = False
+        self.state_published = 0
+        self.state_skipped = 0
+        self.availability_skipped = 0
         self.enable_temp_sensor = False
         self.temp_sensor = False
+        # The internal sensor is noisy, filter it so that only real changes are published
+        self.temp_filter = Pipeline(Median(5), EMA(0.2), Deadband(0.3))
         self.last_temp = 0
 
         self.mqtt_callback = None
+        self.router = TopicRouter(self.pico_id + "/")
+        self.pending_subs = [] # (topic, qos) sent together in one SUBSCRIBE by flush_subscriptions()
+        # QoS 1 delivery, see status_cb()
+        self.state_qos = 0
+        self.delivery_callback = None
+        self.delivered = 0
+        self.delivery_ms = 0 # Time from sending the last acknowledged message to its PUBACK
+        self.delivery_max_ms = 0
+        self.delivery_total_ms = 0
+        # Optional flash backed queue for messages that must survive a reset
+        self.persist = FlashQueue(persist_dir) if persist_dir else None
+        self.persist_keys = {} # (topic, msg, retain, qos) -> sequence number in the flash queue
         self.error_count = 0 # Used to keep track of the number of errors in case of a network failure
         # While the following bug is being worked on https://github.com/micropython/micropython/issues/9505, error_count is used to work around the issue
+        # Reconnection state and metrics
+        self.link_state = _CONNECTED
+        self.next_reconnect = 0
+        self.wifi_deadline = 0
+        self.outage_start = 0
+        self.reconnect_failures = 0 # Failed attempts in the current outage
+        self.reconnect_attempts = 0
+        self.reconnects = 0
+        self.session_resumes = 0 # Reconnects where the broker still had our session
+        self.wifi_recoveries = 0
+        self.last_recovery_ms = 0 # Time from detecting the last outage to being connected again
+        self.max_recovery_ms = 0
+
+        self.setup()
 
+    def create_mqtt_client(self):
+        return MQTTClient(self.pico_id, self.mqtt_server, self.mqtt_port, self.mqtt_user, self.mqtt_password, keepalive=self.mqtt_keepalive)
+
+    def setup(self):
         # Start Initialization
         print(self.pico_id)
         print("ML HA v0.2")
 
-        # Check if LED works
-        print("Checking LED for 5 seconds")
-        self.led.on()
-        time.sleep(5)
+        # Check if LED works, only on power up when booting fast
+        if self.fast_boot and machine.reset_cause() != machine.PWRON_RESET:
+            print("Warm reset, skipping LED check")
+        else:
+            print("Checking LED for 5 seconds")
+            self.led.on()
+            time.sleep(5)
+            self.boot.mark("led_check")
 
         # Initialise Wifi
         print("Initializing WiFi")
@@ -46,11 +143,9 @@ class MLHA:
         # Initialise MQTT
         print("Initializing MQTT")
         self.connectMQTT()
+        self.replay_persistent()
 
-        # Start connection watchdog
-        print("Starting watchdog")
-        self.watchdog = Timer()
-        self.watchdog.init(period=2500, mode=Timer.PERIODIC, callback=self.watchdog_cb)
+        # The connection is watched and recovered from check_mqtt_msg(), in the main loop
         print("ML HA Initialized")
     
     def toggle_led(self, t):
@@ -59,43 +154,167 @@ class MLHA:
     def connectWifi(self):
         # STA_IF = station interface, AP_IF = Access Point interface
         self.wlan.active(True)
-        self.wlan.connect(self.wifi_ssid, self.wifi_password)
+        if self.static_ip is not None:
+            self.wlan.ifconfig(self.static_ip)
 
-        # Wait for connect, fail after 30 seconds
-        max_wait = 30
         # Checking Wi-Fi before continuing
         tim = Timer()
         tim.init(freq=3, mode=Timer.PERIODIC, callback=self.toggle_led)
-        while self.wlan.status() != 3:
-            print("Waiting, wlan status " + str(self.wlan.status()))
-            max_wait -= 1
-            if max_wait == 0:
-                print("Failed to connect to WiFi")
-                machine.reset()
-            time.sleep(1)
+        if self.fast_boot:
+            self.wifi_cache = self.load_wifi_cache()
+        if self.wifi_cache is not None and not self.wait_wifi(ubinascii.unhexlify(self.wifi_cache["bssid"]), 5000):
+            print("Cached access point not available")
+            self.wifi_cache = None
+            self.wlan.disconnect()
+        # Wait for connect, fail after 30 seconds
+        if self.wifi_cache is None and not self.wait_wifi(None, 30000):
+            print("Failed to connect to WiFi")
+            self.reset()
         print("Connected, wlan status " + str(self.wlan.status()))
         status = self.wlan.ifconfig()
         print('connected as ' + status[0])
         tim.deinit()
         self.led.off()
 
-    def watchdog_cb(self, t):
-        # If there is a connection issue for 10 seconds, we reset the Pico
-        if self.error_count > 10:
-            print("MQTT connection lost, resetting")
-            machine.reset()
-        if self.mqtt.is_conn_issue():
-            print("MQTT connection issue, count: " + str(self.error_count))
-            self.error_count += 1
+    def wait_wifi(self, bssid, timeout):
+        if bssid is None:
+            self.wlan.connect(self.wifi_ssid, self.wifi_password)
+        else:
+            self.wlan.connect(self.wifi_ssid, self.wifi_password, bssid=bssid)
+        # The link usually comes up well before the next whole second
+        interval = 10 if self.fast_boot else 1000
+        start = time.ticks_ms()
+        last = None
+        while True:
+            status = self.wlan.status()
+            if status == 3:
+                self.boot.mark("dhcp")
+                return True
+            if status == 2:
+                # Associated, waiting for an address
+                if not self.boot.has("wifi"):
+                    self.boot.mark("wifi")
+            if status != last:
+                print("Waiting, wlan status " + str(status))
+                last = status
+            # A cached access point that refuses us is not worth waiting for
+            if (bssid is not None and status < 0) or time.ticks_diff(time.ticks_ms(), start) >= timeout:
+                return False
+            time.sleep_ms(interval)
+
+    def load_wifi_cache(self):
+        try:
+            with open(self.WIFI_CACHE_FILE) as f:
+                cache = json.load(f)
+            if cache.get("ssid") == self.wifi_ssid:
+                return cache
+        except (OSError, ValueError):
+            pass
+        return None
+
+    # Remembers the strongest access point for our network. Scanning takes a second or two,
+    # so it is done once the device is up and only when the cache is missing
+    def save_wifi_cache(self):
+        # Not retried until the next boot
+        self.wifi_cache = {}
+        best = None
+        try:
+            for ssid, bssid, channel, rssi, security, hidden in self.wlan.scan():
+                if ssid.decode() == self.wifi_ssid and (best is None or rssi > best[3]):
+                    best = (ssid, bssid, channel, rssi)
+        except OSError as ex:
+            print("WiFi scan failed: " + str(ex))
+        if best is None:
+            return
+        self.wifi_cache = {"ssid": self.wifi_ssid, "bssid": ubinascii.hexlify(best[1]).decode(), "channel": best[2]}
+        try:
+            with open(self.WIFI_CACHE_FILE, "w") as f:
+                json.dump(self.wifi_cache, f)
+        except OSError as ex:
+            print("Could not save WiFi cache: " + str(ex))
+
+    # Called from check_mqtt_msg(), returns True while connected. Reconnects with exponential
+    # backoff and random jitter, so that devices do not all hit a restarted broker at once,
+    # restarts the Wi-Fi link if that does not help and resets the Pico as a last resort
+    def maintain_connection(self):
+        now = time.ticks_ms()
+        if self.link_state == _CONNECTED:
+            if not self.mqtt.is_conn_issue():
+                return True
+            print("MQTT connection issue")
+            self.outage_start = now
+            self.reconnect_failures = 0
+            # The will may have marked us offline
+            self.availability_sent = False
             self.mqtt.disconnect()
-            self.mqtt.reconnect()
-            self.mqtt.resubscribe()
+            self.schedule_reconnect(now, self.RECONNECT_BASE)
+            return False
+        if self.link_state == _WIFI:
+            if self.wlan.status() == 3:
+                print("WiFi recovered")
+                self.link_state = _BACKOFF
+                self.next_reconnect = now
+            elif time.ticks_diff(now, self.wifi_deadline) >= 0:
+                print("WiFi recovery timed out")
+                self.reconnect_failed(now)
+            return False
+        if time.ticks_diff(now, self.next_reconnect) < 0:
+            return False
+        if self.wlan.status() != 3:
+            self.recover_wifi(now)
+            return False
+        self.reconnect_attempts += 1
+        session_present = self.mqtt.reconnect()
+        if self.mqtt.conn_issue:
+            self.reconnect_failed(now)
+            return False
+        self.session_present = bool(session_present)
+        if self.session_present:
+            # The broker kept the subscriptions and queued the commands sent meanwhile, only
+            # the send queue has to go out
+            self.session_resumes += 1
         else:
-            self.error_count = 0
+            self.mqtt.resubscribe()
+            self.discovery_cache = None
+        self.link_state = _CONNECTED
+        # Straight away, publish_status may not send anything while the state is unchanged
+        self.send_availability()
+        self.reconnects += 1
+        self.last_recovery_ms = time.ticks_diff(time.ticks_ms(), self.outage_start)
+        self.max_recovery_ms = max(self.max_recovery_ms, self.last_recovery_ms)
+        print("MQTT reconnected after " + str(self.last_recovery_ms) + " ms")
+        return True
+
+    def reconnect_failed(self, now):
+        self.reconnect_failures += 1
+        print("MQTT reconnect failed, count: " + str(self.reconnect_failures))
+        if self.reconnect_failures >= self.RESET_AFTER:
+            print("MQTT connection lost, resetting")
+            self.reset()
+        if self.reconnect_failures == self.WIFI_RECOVER_AFTER:
+            # The link can look fine while the access point no longer routes our traffic
+            self.recover_wifi(now)
+            return
+        self.schedule_reconnect(now, min(self.RECONNECT_BASE << self.reconnect_failures, self.RECONNECT_MAX))
+
+    def schedule_reconnect(self, now, delay):
+        # Somewhere between half and the whole delay
+        self.next_reconnect = time.ticks_add(now, delay // 2 + random.getrandbits(16) % (delay // 2 + 1))
+        self.link_state = _BACKOFF
+
+    def recover_wifi(self, now):
+        print("Restarting WiFi")
+        self.wifi_recoveries += 1
+        self.wlan.disconnect()
+        self.wlan.connect(self.wifi_ssid, self.wifi_password)
+        self.wifi_deadline = time.ticks_add(now, self.WIFI_TIMEOUT)
+        self.link_state = _WIFI
 
     def connectMQTT(self):
+        # DNS, TCP/TLS connect and CONNACK
+        self.mqtt.phase = self.boot.mark
         self.mqtt.set_last_will(self.pico_id + "/system/status", "offline", retain=True)
-        self.mqtt.connect()
+        self.session_present = bool(self.mqtt.connect(not self.persistent_session))
         # Print diagnostic messages when retries/reconnects happens
         self.mqtt.DEBUG = True
         # Information whether we store unsent messages with the flag QoS==0 in the queue.
@@ -103,67 +322,204 @@ class MLHA:
         # Option, limits the possibility of only one unique message being queued.
         self.mqtt.NO_QUEUE_DUPS = True
         # Limit the number of unsent messages in the queue.
-        self.mqtt.MSG_QUEUE_MAX = 5
+        self.mqtt.MSG_QUEUE_MAX = 16
+        # QoS 1 messages on the wire without a PUBACK, further ones wait in the queue
+        self.mqtt.INFLIGHT_MAX = 4
+        # Only the latest state snapshot is worth sending after an outage
+        self.mqtt.coalesce.add(self.pico_id + "/state")
         # Sets the callback function for the MQTTClient object.
         self.mqtt.set_callback(self.sub_cb)
+        self.mqtt.set_callback_status(self.status_cb)
+        self.mqtt.set_callback_suback(self.suback_cb)
+
+    def reset(self):
+        # Write whatever is still buffered for the flash queue before resetting
+        if self.persist is not None:
+            self.persist.flush(True)
+        machine.reset()
+
+    def replay_persistent(self):
+        # Messages that were not delivered before the last reset go out before anything else
+        if self.persist is not None:
+            self.persist.replay(lambda seq, topic, msg, retain, qos: self.publish_persistent(topic, msg, retain, seq))
+
+    def publish_persistent(self, topic, msg, retain, seq):
+        if seq >= 0:
+            if len(self.persist_keys) >= self.persist.capacity:
+                # Delivery of the forgotten ones is not recorded, they are replayed once more after a reset
+                self.persist_keys.clear()
+            self.persist_keys[(topic, msg, retain, 1)] = seq
+        self.mqtt.publish(topic, msg, retain, qos=1)
+
+    def suback_cb(self, pid, codes):
+        if not self.boot.has("subscribed"):
+            self.boot.mark("subscribed")
+        # Called before the pid is forgotten, so the filters of the SUBSCRIBE are still known
+        key = self.mqtt.pids.get(pid)
+        if key is not None:
+            for (topic, qos), code in zip(key[1], codes):
+                if code == 0x80:
+                    print("Subscription refused: " + str(topic))
+
+    def status_cb(self, pid, status):
+        # Called by robust2 before it forgets the pid, so the message is still known
+        if status != 1:
+            return
+        key = self.mqtt.pids.get(pid)
+        if key is None or key[0] != 0:
+            return
+        self.message_acked(key[1], self.mqtt.latency)
+
+    # Bookkeeping for a QoS 1 message (topic, msg, retain, qos) the broker acknowledged
+    def message_acked(self, message, latency):
+        self.delivered += 1
+        self.delivery_ms = latency
+        self.delivery_total_ms += latency
+        if latency > self.delivery_max_ms:
+            self.delivery_max_ms = latency
+        topic = message[0]
+        if self.delivery_callback is not None:
+            self.delivery_callback(topic, latency)
+        if self.persist is not None:
+            seq = self.persist_keys.pop(message, None)
+            if seq is not None:
+                self.persist.done(seq)
+        pending = self.pending_hashes.get(topic)
+        if pending is not None and pending[0] == message[1]:
+            del self.pending_hashes[topic]
+            self.config_hashes[topic] = pending[1]
+            self.config_hashes_dirty = True
+
+    # Calls callback(topic, latency_ms) whenever the broker acknowledges a QoS 1 message
+    def set_delivery_callback(self, callback):
+        self.delivery_callback = callback
+
+    # Number of QoS 1 messages sent before waiting for their PUBACK, 0 for no limit
+    def set_inflight_max(self, n):
+        self.mqtt.INFLIGHT_MAX = n
+
+    def set_state_qos(self, qos):
+        self.state_qos = qos
 
     def sub_cb(self, topic, msg, retained, duplicate):
         self.led.on()
-        print("Received message on topic " + (topic).decode() + "( " + str(retained) + "|" + str(duplicate) + " )" + ": " + (msg).decode())
-        if self.mqtt_callback is not None:
-            self.mqtt_callback((topic).decode().replace(self.pico_id+"/", ''), msg, retained, duplicate)
+        # Routed messages stay as bytes, only the catch-all callback gets a decoded topic
+        if not self.router.dispatch(topic, msg, retained, duplicate):
+            print("Received message on topic " + (topic).decode() + "( " + str(retained) + "|" + str(duplicate) + " )" + ": " + (msg).decode())
+            if self.mqtt_callback is not None:
+                self.mqtt_callback((topic).decode().replace(self.pico_id+"/", ''), msg, retained, duplicate)
         self.led.off()
     
     def set_callback(self, callback):
         self.mqtt_callback = callback
+
+    # Calls handler(topic, msg, retained, duplicate) for messages matching topic, which may contain + and # wildcards.
+    # topic and msg are passed as bytes
+    def route(self, topic, handler, absolute=False, subscribe=True):
+        self.router.add(topic, handler, absolute)
+        if subscribe:
+            self.subscribe(topic, absolute)
     
+    # Subscriptions are sent in one packet by the next check_mqtt_msg() call
     def subscribe(self, topic, absolute=False):
-        if absolute:
-            self.mqtt.subscribe(topic)
-        else:
-            self.mqtt.subscribe(self.pico_id + "/" + topic)
+        if not absolute:
+            topic = self.pico_id + "/" + topic
+        for pending in self.pending_subs:
+            if pending[0] == topic:
+                return
+        # The broker only queues messages missed while offline for QoS 1 subscriptions
+        self.pending_subs.append((topic, 1 if self.persistent_session else 0))
+
+    def unsubscribe(self, topic, absolute=False):
+        if not absolute:
+            topic = self.pico_id + "/" + topic
+        self.pending_subs = [pending for pending in self.pending_subs if pending[0] != topic]
+        self.mqtt.unsubscribe(topic)
 
-    def publish(self, topic, msg, retain=False):
-        self.mqtt.publish(b""+self.pico_id + "/" + topic, msg, retain)
+    def flush_subscriptions(self):
+        if self.pending_subs:
+            self.mqtt.subscribe_many(self.pending_subs)
+            self.pending_subs = []
+
+    def publish(self, topic, msg, retain=False, persist=False, qos=0):
+        if persist and self.persist is not None:
+            # Sent with QoS 1 so that delivery can be confirmed before it is dropped from flash
+            topic = self.pico_id + "/" + topic
+            self.publish_persistent(topic, msg, retain, self.persist.append(topic, msg, retain))
+        else:
+            self.mqtt.publish(b""+self.pico_id + "/" + topic, msg, retain, qos)
 
     def set_device_name(self, name):
         self.device_name = name
+        self.discovery_cache = None
     
+    def set_state_min_interval(self, ms):
+        self.state_min_interval = ms
+
+    def set_device_discovery(self, bool):
+        # Requires HomeAssistant 2024.11 or newer, older versions only understand per entity discovery
+        self.device_discovery = bool
+
     def set_enable_temp_sensor(self, bool):
         self.enable_temp_sensor = bool
     
     def update_temp_sensor(self):
         if self.enable_temp_sensor:
             if not self.temp_sensor:
-                self.temp_sensor = machine.ADC(4)
+                self.temp_sensor = OversampledADC(machine.ADC(4), 16)
                 self.publish_config(self.device_name + "_temperature", self.device_name + " Temperature", device_class="temperature", unit_of_measurement="C", state_class="measurement", state_topic="/"+self.device_name + "_temperature", expire_after=300)
             temp_voltage = self.temp_sensor.read_u16() * (3.3 / 65535)
-            temp_celsius = round((27 - (temp_voltage - 0.706) / 0.001721), 2)
+            temp_celsius = round(self.temp_filter(27 - (temp_voltage - 0.706) / 0.001721), 2)
             if self.last_temp != temp_celsius:
                 self.last_temp = temp_celsius
                 self.publish(self.device_name + "_temperature" + "/state", str(temp_celsius))
 
-    # Discovery packet for Homeassistant
-    def publish_config(self, discovery_topic, name, device_type="sensor", device_class=None, unit_of_measurement=None, state_class=None, state_topic="", expire_after=60):
-        print("Publishing discovery packet for " + name)
-        config_payload = {
-            "name": name,
-            "state_topic": self.pico_id + state_topic + "/state",
-            "availability": [
+    def load_config_hashes(self):
+        try:
+            with open(self.CONFIG_HASHES_FILE) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_config_hashes(self):
+        if self.config_hashes_dirty:
+            self.config_hashes_dirty = False
+            try:
+                with open(self.CONFIG_HASHES_FILE, "w") as f:
+                    json.dump(self.config_hashes, f)
+            except OSError as ex:
+                print("Could not save discovery hashes: " + str(ex))
+
+    def clear_config_hashes(self):
+        # Forces every discovery packet to be sent again, e.g. after the broker lost its retained messages
+        self.config_hashes = {}
+        self.config_hashes_dirty = True
+
+    # Availability and device blocks shared by every discovery packet
+    def discovery_shared(self):
+        if self.discovery_cache is None:
+            availability = [
                 {
                     "topic": self.pico_id + "/system/status",
                     "payload_available": "online",
                     "payload_not_available": "offline"
                 }
-            ],
-            "device": {
+            ]
+            device = {
                 "identifiers": self.pico_id,
                 "name": self.device_name,
                 "manufacturer": "MakerLab",
                 "model": "RPI Pico W MLHA",
                 "sw_version": "0.2",
                 "connections": [ ["ip", self.wlan.ifconfig()[0]], ["mac", ubinascii.hexlify(self.wlan.config('mac')).decode()] ]
-            },
+            }
+            self.discovery_cache = (availability, device, '"availability": ' + json.dumps(availability) + ', "device": ' + json.dumps(device))
+        return self.discovery_cache
+
+    def entity_config(self, discovery_topic, name, device_type="sensor", device_class=None, unit_of_measurement=None, state_class=None, state_topic="", expire_after=60):
+        config_payload = {
+            "name": name,
+            "state_topic": self.pico_id + state_topic + "/state",
             "unique_id": self.pico_id + "-" + discovery_topic,
             "device_class": device_class,
             "value_template": "{{ value_json." + discovery_topic + " }}",
@@ -196,25 +552,253 @@ class MLHA:
             config_payload["state_off"] = False
             config_payload["icon"] = "mdi:power"
 
-        self.mqtt.publish("homeassistant/" + device_type + "/" + self.pico_id + "/" + discovery_topic + "/config", json.dumps(config_payload), retain=True)
+        return config_payload
 
-    def publish_status(self, status_data):
-        self.led.on()
+    # Publishes a retained discovery payload unless the broker already has this exact content
+    def publish_retained_config(self, config_topic, payload, force=False):
+        if not self.boot.has("discovery"):
+            self.boot.mark("discovery")
+        digest = ubinascii.hexlify(uhashlib.sha256(payload.encode()).digest()[:8]).decode()
+        if not force and self.config_hashes.get(config_topic) == digest:
+            return False
+        # QoS 1, status_cb saves the hash once the broker has acknowledged the payload
+        self.mqtt.publish(config_topic, payload, retain=True, qos=1)
+        self.pending_hashes[config_topic] = (payload, digest)
+        return True
+
+    def device_config_topic(self):
+        return "homeassistant/device/" + self.pico_id + "/config"
+
+    def publish_entity_config(self, discovery_topic, config, device_type, force=False):
+        config_payload = json.dumps(config)
+        # Splice the pre-serialized availability and device blocks into the entity config
+        payload = config_payload[:-1] + ", " + self.discovery_shared()[2] + "}"
+        published = self.publish_retained_config("homeassistant/" + device_type + "/" + self.pico_id + "/" + discovery_topic + "/config", payload, force)
+        if published:
+            print("Publishing discovery packet for " + config["name"])
+        else:
+            print("Discovery packet for " + config["name"] + " unchanged, skipping")
+        # Remove the device discovery message of a previous run, HomeAssistant would see every entity twice
+        bundle_topic = self.device_config_topic()
+        if bundle_topic in self.config_hashes and not self.mqtt.conn_issue:
+            self.mqtt.publish(bundle_topic, "", retain=True)
+            del self.config_hashes[bundle_topic]
+            self.config_hashes_dirty = True
+        return published
+
+    # Discovery packet for Homeassistant
+    def publish_config(self, discovery_topic, name, device_type="sensor", device_class=None, unit_of_measurement=None, state_class=None, state_topic="", expire_after=60, force=False):
+        config = self.entity_config(discovery_topic, name, device_type, device_class, unit_of_measurement, state_class, state_topic, expire_after)
+        if state_topic == "":
+            self.add_state_key(discovery_topic)
+        if state_topic == "" and expire_after:
+            # The state has to be sent again before HomeAssistant marks the entity unavailable
+            heartbeat = expire_after * 500
+            if not self.state_heartbeat or heartbeat < self.state_heartbeat:
+                self.state_heartbeat = heartbeat
+        self.register_config(discovery_topic, config, device_type, force)
+
+    def register_config(self, discovery_topic, config, device_type, force=False):
+        if self.device_discovery:
+            # Sent together with the other entities by publish_device_config()
+            config["p"] = device_type
+            self.components[discovery_topic] = config
+            self.components_dirty = True
+            return
+        if self.pending_configs or (self.fast_boot and self.first_state_ms is None) or not self.discovery_room():
+            self.pending_configs.append((discovery_topic, config, device_type, force))
+            return
+        self.publish_entity_config(discovery_topic, config, device_type, force)
+
+    # Discovery configs are QoS 1 and only go out while they fit in the in-flight window, so
+    # registering dozens of entities never pushes them through the bounded send queue
+    def discovery_room(self):
+        return not self.mqtt.conn_issue and not self.mqtt.window_full() and not self.mqtt.msg_to_send.has_qos1()
+
+    # Device discovery packet holding every entity registered with publish_config()
+    def publish_device_config(self, force=False):
+        self.components_dirty = False
+        if not self.components:
+            return False
+        availability, device, _ = self.discovery_shared()
+        base = self.pico_id + "/"
+        components = {}
+        try:
+            for key, config in self.components.items():
+                component = {}
+                for k, v in config.items():
+                    # "~" is expanded to the base topic by HomeAssistant
+                    if k.endswith("_topic") and v.startswith(base):
+                        v = "~/" + v[len(base):]
+                    component[k] = v
+                components[key] = component
+            payload = json.dumps({"~": self.pico_id, "dev": device, "o": {"name": "MakerLab MLHA", "sw": "0.2"}, "availability": availability, "cmps": components})
+        except MemoryError:
+            print("Device discovery packet too large, publishing per entity")
+            self.device_discovery = False
+            published = False
+            for key, config in self.components.items():
+                device_type = config.pop("p")
+                published = self.publish_entity_config(key, config, device_type, force) or published
+            self.components = {}
+            return published
+        published = self.publish_retained_config(self.device_config_topic(), payload, force)
+        if published:
+            print("Publishing device discovery packet with " + str(len(components)) + " entities")
+        else:
+            print("Device discovery packet unchanged, skipping")
+        if self.mqtt.conn_issue:
+            return published
+        # Remove the per entity discovery messages of a previous run
+        for topic in [t for t in self.config_hashes if t.startswith("homeassistant/") and not t.startswith("homeassistant/device/")]:
+            self.mqtt.publish(topic, "", retain=True)
+            del self.config_hashes[topic]
+            self.config_hashes_dirty = True
+        return published
+
+    # Sends the discovery messages that were held back as far as the window allows, returns True
+    # if any had changed
+    def flush_discovery(self):
+        published = False
+        while self.pending_configs and self.discovery_room():
+            discovery_topic, config, device_type, force = self.pending_configs.pop(0)
+            published = self.publish_entity_config(discovery_topic, config, device_type, force) or published
+        if self.components_dirty and self.discovery_room():
+            published = self.publish_device_config() or published
+        if published and self.state_sent:
+            # HomeAssistant only reads the state topic once it knows the entities, send it again
+            self.pending_state = True
+        return published
+
+    # Publishes the boot phase times once, as soon as the first state, discovery and subscriptions are done
+    def publish_boot_profile(self):
+        if self.boot.done or self.first_state_ms is None or self.pending_configs or self.components_dirty:
+            return
+        # The asyncio client does not keep sub_to_confirm
+        if self.pending_subs or getattr(self.mqtt, "sub_to_confirm", None):
+            return
+        self.boot.finish()
+        summary = self.boot.summary()
+        print("Boot phases (ms since reset): " + str(summary))
+        summary["reset_cause"] = machine.reset_cause()
+        config = self.entity_config("boot_time", "Boot time", "sensor", "duration", "ms", "measurement", "/boot", 0)
+        config["value_template"] = "{{ value_json.first_publish }}"
+        config["json_attributes_topic"] = config["state_topic"]
+        config["entity_category"] = "diagnostic"
+        self.register_config("boot_time", config, "sensor")
+        self.mqtt.publish(config["state_topic"], json.dumps(summary), retain=True)
+
+    def add_state_key(self, key):
+        if key not in self.state_keys:
+            self.state_keys.append(key)
+            self.compile_state()
+
+    # Rebuilds the state serializer, keeping the values already set
+    def compile_state(self):
+        previous = self.state
+        self.state = StateEncoder(self.state_keys, self.state_precision)
+        if previous is not None:
+            for key in previous.keys:
+                self.state.set(key, previous.get(key))
+        self.state_sent = False
+
+    def set_state_precision(self, digits):
+        self.state_precision = digits
+        if self.state is not None:
+            self.compile_state()
+
+    def add_entity(self, entity):
+        self.entities.append(entity)
+
+    # Sets one value of the JSON state message without building a dict
+    def set_state(self, key, value):
+        if self.state is None or key not in self.state.index:
+            self.add_state_key(key)
+        self.state.set(key, value)
+
+    # Only publishes when a value changed or the heartbeat is due, changes within state_min_interval
+    # of the previous publish are sent by check_mqtt_msg() once the interval has passed.
+    # status_data is optional, values can also be set one by one with set_state()
+    def publish_status(self, status_data=None):
         if not self.mqtt.is_keepalive():
             # Dont do anything if we are not connected
             print("MQTT not connected, skipping")
             return
-        stringified_data = json.dumps(status_data)
-        self.mqtt.publish(self.pico_id + "/system/status", "online", retain=True)
-        self.mqtt.publish(self.pico_id + "/state", stringified_data)
+        if status_data is not None:
+            for key in status_data:
+                self.set_state(key, status_data[key])
+        for entity in self.entities:
+            entity.export()
+        if self.state is None:
+            return
+        now = time.ticks_ms()
+        if self.state_sent:
+            elapsed = time.ticks_diff(now, self.last_state_ms)
+            if not self.state.changed():
+                self.pending_state = False
+                if not self.state_heartbeat or elapsed < self.state_heartbeat:
+                    self.state_skipped += 1
+                    return
+            elif elapsed < self.state_min_interval:
+                self.pending_state = True
+                self.state_skipped += 1
+                return
+        self.send_state(now)
+
+    # Availability is retained, it only has to be sent again after the last will went out
+    def send_availability(self):
+        self.mqtt.publish(self.topic_availability, "online", retain=True)
+        self.availability_sent = not self.mqtt.conn_issue
+
+    def send_state(self, now):
+        self.led.on()
+        if self.availability_sent:
+            self.availability_skipped += 1
+        else:
+            self.send_availability()
+        # The encoder's buffer is handed to the client as is, it copies it if the message has to be queued
+        self.mqtt.publish(self.topic_state, self.state.encode(), qos=self.state_qos)
+        if self.mqtt.conn_issue:
+            # Lost with the connection, flush_state sends it again once maintain_connection recovered
+            self.pending_state = True
+            self.led.off()
+            return
+        self.state.mark_sent()
+        if self.first_state_ms is None:
+            # ticks_ms() starts at 0 on reset
+            self.boot.mark("first_publish")
+            self.first_state_ms = now
+            print("First state published " + str(now) + " ms after reset")
+        self.state_sent = True
+        self.last_state_ms = now
+        self.pending_state = False
+        self.state_published += 1
         self.led.off()
 
+    def flush_state(self):
+        if self.pending_state:
+            now = time.ticks_ms()
+            if time.ticks_diff(now, self.last_state_ms) >= self.state_min_interval:
+                self.send_state(now)
+
     def check_mqtt_msg(self):
         try:
-            # Do nothing if the connection is not established, the timer will handle reconnection
-            if self.mqtt.is_keepalive():
+            # Do nothing else while the connection is being recovered
+            if self.maintain_connection() and self.mqtt.is_keepalive():
+                self.flush_subscriptions()
                 self.mqtt.check_msg() # needed when publish(qos=1), ping(), subscribe()
+                # Handle every ack already received, so the in-flight window drains before send_queue refills it
+                while not self.mqtt.conn_issue and self.mqtt.rbuf.packet() is not None:
+                    self.mqtt.check_msg()
                 self.mqtt.send_queue() # needed when using the caching capabilities for unsent messages
+                self.flush_state()
+            if self.persist is not None:
+                self.persist.flush() # rate limited, only writes when a batch is pending
+            self.flush_discovery()
+            self.publish_boot_profile()
+            self.save_config_hashes()
+            if self.fast_boot and self.wifi_cache is None and self.first_state_ms is not None and not self.mqtt.conn_issue:
+                self.save_wifi_cache()
         except Exception as ex:
             print("error: " + str(ex))
-            machine.reset()
+            self.reset()
@@ -0,0 +1,129 @@
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from umqtt.aio import MQTTClient
+from makerlab import mlha
+
+# asyncio flavour of MLHA. Nothing blocks in the constructor, call start() from a running
+# event loop instead. Incoming messages are dispatched by the MQTT reader task as soon as
+# they arrive, so there is no need to call check_mqtt_msg() from the main loop.
+#
+# async def main():
+#     mlha = MLHA(wifi_SSID, wifi_password, mqtt_server)
+#     await mlha.start()
+#     await mlha.asubscribe("switch/toggle/led")
+#     while True:
+#         await mlha.apublish("state", "...")
+#         await asyncio.sleep(30)
+#
+# asyncio.run(main())
+class MLHA(mlha.MLHA):
+    def create_mqtt_client(self):
+        return MQTTClient(self.pico_id, self.mqtt_server, self.mqtt_port, self.mqtt_user, self.mqtt_password, keepalive=self.mqtt_keepalive)
+
+    def setup(self):
+        pass
+
+    async def start(self):
+        print(self.pico_id)
+        print("ML HA v0.2 (asyncio)")
+
+        # Check if LED works
+        print("Checking LED for 5 seconds")
+        self.led.on()
+        await asyncio.sleep(5)
+
+        print("Initializing WiFi")
+        await self.connectWifi()
+
+        print("Initializing MQTT")
+        await self.connectMQTT()
+        self.replay_persistent()
+
+        print("Starting watchdog")
+        self.watchdog = asyncio.create_task(self.watchdog_task())
+        print("ML HA Initialized")
+
+    async def connectWifi(self):
+        self.wlan.active(True)
+        self.wlan.connect(self.wifi_ssid, self.wifi_password)
+
+        # Wait for connect, fail after 30 seconds
+        max_wait = 300
+        while self.wlan.status() != 3:
+            self.led.toggle()
+            max_wait -= 1
+            if max_wait == 0:
+                print("Failed to connect to WiFi")
+                self.reset()
+            await asyncio.sleep(0.1)
+        print("Connected, wlan status " + str(self.wlan.status()))
+        status = self.wlan.ifconfig()
+        print('connected as ' + status[0])
+        self.led.off()
+
+    async def connectMQTT(self):
+        self.mqtt.set_last_will(self.pico_id + "/system/status", "offline", retain=True)
+        self.mqtt.DEBUG = True
+        self.mqtt.KEEP_QOS0 = False
+        # Discovery is published in a burst right after connecting, leave room for it
+        self.mqtt.MSG_QUEUE_MAX = 20
+        self.mqtt.set_callback(self.sub_cb)
+        self.mqtt.set_callback_status(self.status_cb)
+        await self.mqtt.connect()
+        # Reader, send queue, keepalive and reconnect tasks
+        self.mqtt.start()
+
+    async def watchdog_task(self):
+        # Reconnection is handled by the MQTT client itself, we only reset the Pico if it
+        # does not manage to recover for a while
+        while True:
+            await asyncio.sleep(2.5)
+            if self.persist is not None:
+                self.persist.flush() # rate limited, only writes when a batch is pending
+            if self.error_count > 10:
+                print("MQTT connection lost, resetting")
+                self.reset()
+            if self.mqtt.is_conn_issue():
+                print("MQTT connection issue, count: " + str(self.error_count))
+                self.error_count += 1
+                self.availability_sent = False
+            else:
+                self.error_count = 0
+                if not self.availability_sent:
+                    self.send_availability()
+                self.flush_discovery()
+                self.publish_boot_profile()
+                self.save_config_hashes()
+                # Changes held back by the minimum state interval
+                self.flush_state()
+
+    def check_mqtt_msg(self):
+        pass
+
+    # Called by the client before it forgets the pid, the message is still in pub_acks
+    def status_cb(self, pid, status):
+        item = self.mqtt.pub_acks.get(pid)
+        if status == 1 and item is not None:
+            self.message_acked((item[0], item[1], item[2], item[3]), self.mqtt.latency)
+
+    # The client writes straight to the stream while connected, configs only have to wait
+    # for the connection and for the queue built up during an outage to drain
+    def discovery_room(self):
+        return self.mqtt.is_connected() and not self.mqtt.msg_to_send
+
+    # The client sends its subscriptions from its own task, there is nothing to batch
+    def subscribe(self, topic, absolute=False):
+        if absolute:
+            self.mqtt.subscribe(topic)
+        else:
+            self.mqtt.subscribe(self.pico_id + "/" + topic)
+
+    async def asubscribe(self, topic, absolute=False):
+        if absolute:
+            return await self.mqtt.asubscribe(topic)
+        return await self.mqtt.asubscribe(self.pico_id + "/" + topic)
+
+    async def apublish(self, topic, msg, retain=False, qos=0):
+        return await self.mqtt.apublish(self.pico_id + "/" + topic, msg, retain, qos)
@@ -28,7 +28,7 @@ class A:
 		if A.error_count>10:B('MQTT connection lost, resetting');G.reset()
 		if A.mqtt.is_conn_issue():B('MQTT connection issue, count: '+C(A.error_count));A.error_count+=1;A.mqtt.disconnect();A.mqtt.reconnect();A.mqtt.resubscribe()
 		else:A.error_count=0
-	def connectMQTT(A):A.mqtt.set_last_will(A.pico_id+N,S,retain=E);A.mqtt.connect();A.mqtt.DEBUG=E;A.mqtt.KEEP_QOS0=F;A.mqtt.NO_QUEUE_DUPS=E;A.mqtt.MSG_QUEUE_MAX=2;A.mqtt.set_callback(A.sub_cb)
+	def connectMQTT(A):A.mqtt.set_last_will(A.pico_id+N,S,retain=E);A.mqtt.connect();A.mqtt.DEBUG=E;A.mqtt.KEEP_QOS0=F;A.mqtt.NO_QUEUE_DUPS=E;A.mqtt.MSG_QUEUE_MAX=8;A.mqtt.coalesce.add(A.pico_id+P);A.mqtt.set_callback(A.sub_cb)
 	def sub_cb(A,topic,msg,retained,duplicate):
 		G=duplicate;F=retained;E=topic;A.led.on();B('Received message on topic '+E.decode()+'( '+C(F)+'|'+C(G)+' )'+': '+msg.decode())
 		if A.mqtt_callback is not D:A.mqtt_callback(E.decode().replace(A.pico_id+H,O),msg,F,G)
@@ -0,0 +1,148 @@
+from array import array
+import micropython
+from machine import Pin
+from time import ticks_ms, ticks_diff
+
+
+class Button:
+    __slots__ = ("events", "id", "pin", "active", "debounce", "long_press", "on_press", "on_release", "on_long_press",
+                 "raw", "raw_time", "stable", "press_time", "long_fired", "isr")
+
+    def __init__(self, events, id, pin, active, debounce, long_press, on_press, on_release, on_long_press):
+        self.events = events
+        self.id = id
+        self.pin = pin
+        self.active = active # Pin level while the button is pressed
+        self.debounce = debounce
+        self.long_press = long_press
+        self.on_press = on_press
+        self.on_release = on_release # Called with the press duration in ms, not after a long press
+        self.on_long_press = on_long_press
+        self.raw = self.stable = pin.value()
+        self.raw_time = self.press_time = ticks_ms()
+        self.long_fired = False
+        # Bound once, creating a bound method in the interrupt would allocate
+        self.isr = self._isr
+        pin.irq(trigger=Pin.IRQ_RISING | Pin.IRQ_FALLING, handler=self.isr)
+
+    def _isr(self, pin):
+        self.events.push(self.id, pin.value())
+
+    def pressed(self):
+        return self.stable == self.active
+
+    # ms until update() has something to do, -1 while the button is idle
+    def due(self, now):
+        if self.raw != self.stable:
+            return max(0, self.debounce - ticks_diff(now, self.raw_time))
+        if self.stable == self.active and not self.long_fired and self.on_long_press is not None:
+            return max(0, self.long_press - ticks_diff(now, self.press_time))
+        return -1
+
+    def update(self, now):
+        if self.raw != self.stable:
+            # A level only counts once it has been stable for the debounce time
+            if ticks_diff(now, self.raw_time) < self.debounce:
+                return
+            self.stable = self.raw
+            if self.stable == self.active:
+                self.press_time = self.raw_time
+                self.long_fired = False
+                if self.on_press is not None:
+                    self.on_press()
+            elif not self.long_fired and self.on_release is not None:
+                self.on_release(ticks_diff(self.raw_time, self.press_time))
+        elif self.stable == self.active and not self.long_fired and self.on_long_press is not None:
+            if ticks_diff(now, self.press_time) >= self.long_press:
+                self.long_fired = True
+                self.on_long_press()
+
+
+# Input handling that keeps interrupt handlers minimal. Pin interrupts only store the time and
+# level of each edge in a preallocated ring, debouncing and the button callbacks run from
+# process(), in the main loop, where they are free to publish, sleep or allocate.
+#
+# inputs = InputEvents()
+# inputs.button(Pin(14, Pin.IN, Pin.PULL_DOWN), on_press=ring, debounce=150)
+# inputs.schedule(sched)
+class InputEvents:
+    def __init__(self, capacity=32):
+        self.times = array("L", [0] * capacity)
+        self.codes = bytearray(capacity) # button id << 1 | level
+        self.head = 0 # Only moved by process()
+        self.tail = 0 # Only moved by the interrupts
+        self.buttons = []
+        self.overflows = 0
+        self.sched = None
+        self.task = None # Pending run of process() on the scheduler
+        self.arm = None
+
+    def button(self, pin, on_press=None, on_release=None, on_long_press=None, active=1, debounce=50, long_press=1000):
+        if len(self.buttons) >= 128:
+            raise ValueError("too many buttons")
+        button = Button(self, len(self.buttons), pin, active, debounce, long_press, on_press, on_release, on_long_press)
+        self.buttons.append(button)
+        return button
+
+    # Called from interrupt context
+    def push(self, id, level):
+        i = self.tail
+        n = i + 1
+        if n == len(self.codes):
+            n = 0
+        if n == self.head:
+            self.overflows += 1
+            return
+        self.times[i] = ticks_ms()
+        self.codes[i] = id << 1 | level
+        self.tail = n
+        if self.arm is not None:
+            try:
+                micropython.schedule(self.arm, None)
+            except RuntimeError:
+                pass # Schedule queue full, the edge is picked up by the next one
+
+    def process(self):
+        while self.head != self.tail:
+            i = self.head
+            button = self.buttons[self.codes[i] >> 1]
+            # Settle the previous level first, so a press is not lost if several edges queued up
+            button.update(self.times[i])
+            button.raw = self.codes[i] & 1
+            button.raw_time = self.times[i]
+            self.head = i + 1 if i + 1 < len(self.codes) else 0
+        now = ticks_ms()
+        for button in self.buttons:
+            button.update(now)
+
+    # ms until process() has work, -1 when no edge is queued and no button is settling
+    def due(self):
+        if self.head != self.tail:
+            return 0
+        now = ticks_ms()
+        wait = -1
+        for button in self.buttons:
+            left = button.due(now)
+            if left >= 0 and (wait < 0 or left < wait):
+                wait = left
+        return wait
+
+    # Runs process() from a Scheduler only when there is something to do: the interrupt arms it
+    # through micropython.schedule, and it re-arms itself while a debounce or long press is pending
+    def schedule(self, sched):
+        self.sched = sched
+        # Bound once, creating a bound method in the interrupt would allocate
+        self.arm = self._arm
+        self._arm(None)
+
+    def _arm(self, _):
+        if self.task is None:
+            self.task = self.sched.after(0, self._run)
+
+    def _run(self):
+        self.task = None
+        self.process()
+        wait = self.due()
+        # An edge during process() may have armed it already
+        if wait >= 0 and self.task is None:
+            self.task = self.sched.after(wait, self._run)
@@ -0,0 +1,43 @@
+from array import array
+from time import ticks_us, ticks_diff
+
+
+# Boot phase timer. mark() stores ticks_us() under a phase name, and as ticks_us() starts at 0
+# on reset every mark is the time since reset. Marking a phase again keeps the latest time,
+# and once finish() is called marks are ignored, so the hooks can stay in place after boot.
+#
+# boot = BootProfiler()
+# boot.mark("wifi")
+# ...
+# print(boot.summary()) # {"wifi": 1840, ...} in ms since reset
+class BootProfiler:
+    def __init__(self, capacity=16):
+        self.names = []
+        self.times = array("l", [0] * capacity)
+        self.done = False
+
+    def mark(self, name):
+        if self.done:
+            return
+        t = ticks_us()
+        try:
+            i = self.names.index(name)
+        except ValueError:
+            i = len(self.names)
+            if i == len(self.times):
+                return
+            self.names.append(name)
+        self.times[i] = t
+
+    def has(self, name):
+        return name in self.names
+
+    # ms since reset of every phase, in the order they were first reached
+    def summary(self):
+        result = {}
+        for i in range(len(self.names)):
+            result[self.names[i]] = ticks_diff(self.times[i], 0) // 1000
+        return result
+
+    def finish(self):
+        self.done = True
@@ -0,0 +1,194 @@
+import os
+import struct
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython, so the queue can be exercised on Linux with a plain directory
+    from time import monotonic
+    def ticks_ms():
+        return int(monotonic() * 1000)
+    def ticks_diff(a, b):
+        return a - b
+
+# Append-only log of outgoing messages kept on the Pico's filesystem so that important
+# messages survive machine.reset(). Every record is a 10 byte header followed by topic and
+# payload. Header: kind (1 = message added, 2 = message delivered), sequence number,
+# flags (retain | qos << 1), topic length, payload length.
+_HDR = "<BIBHH"
+_HDR_LEN = 10
+_ADD = 1
+_DONE = 2
+
+
+class FlashQueue:
+    def __init__(self, path="/mlq", capacity=32, batch_size=512, max_writes_per_min=6, max_log_size=8192):
+        self.path = path
+        self.log_path = path + "/q.log"
+        self.max_log_size = max_log_size
+        self.max_writes_per_min = max_writes_per_min
+
+        # Undelivered messages are tracked in a fixed window of `capacity` sequence numbers,
+        # if more than that are outstanding the oldest ones are given up
+        self.capacity = capacity
+        self.pending = bytearray(capacity)
+        self.pending_seq = [0] * capacity
+        self.pending_count = 0
+        self.seq = 1
+
+        # Records are collected here and written to flash in one go
+        self.batch = bytearray(batch_size)
+        self.batch_len = 0
+
+        # Token bucket limiting the number of flash writes per minute
+        self.tokens = max_writes_per_min
+        self.last_refill = ticks_ms()
+
+        self.writes = 0
+        self.compactions = 0
+        self.dropped = 0
+
+        try:
+            os.mkdir(path)
+        except OSError:
+            pass
+        self._load()
+
+    def _records(self, path):
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return
+        header = bytearray(_HDR_LEN)
+        try:
+            while f.readinto(header) == _HDR_LEN:
+                kind, seq, flags, topic_len, msg_len = struct.unpack(_HDR, header)
+                topic = f.read(topic_len)
+                msg = f.read(msg_len)
+                if len(topic) != topic_len or len(msg) != msg_len:
+                    # Torn write at the end of the log
+                    break
+                yield kind, seq, flags, topic, msg
+        finally:
+            f.close()
+
+    def _load(self):
+        for kind, seq, flags, topic, msg in self._records(self.log_path):
+            if kind == _ADD:
+                self._mark(seq)
+            elif kind == _DONE:
+                self._unmark(seq)
+            if seq >= self.seq:
+                self.seq = seq + 1
+
+    def _is_pending(self, seq):
+        slot = seq % self.capacity
+        return self.pending[slot] and self.pending_seq[slot] == seq
+
+    def _mark(self, seq):
+        slot = seq % self.capacity
+        if self.pending[slot]:
+            self.dropped += 1
+        else:
+            self.pending_count += 1
+        self.pending[slot] = 1
+        self.pending_seq[slot] = seq
+
+    def _unmark(self, seq):
+        if self._is_pending(seq):
+            self.pending[seq % self.capacity] = 0
+            self.pending_count -= 1
+            return True
+        return False
+
+    def _record(self, kind, seq, flags, topic, msg):
+        size = _HDR_LEN + len(topic) + len(msg)
+        if self.batch_len + size > len(self.batch):
+            self.flush()
+            if self.batch_len + size > len(self.batch):
+                return False
+        struct.pack_into(_HDR, self.batch, self.batch_len, kind, seq, flags, len(topic), len(msg))
+        pos = self.batch_len + _HDR_LEN
+        self.batch[pos:pos + len(topic)] = topic
+        pos += len(topic)
+        self.batch[pos:pos + len(msg)] = msg
+        self.batch_len = pos + len(msg)
+        return True
+
+    def append(self, topic, msg, retain=False, qos=1):
+        # Returns the sequence number to pass to done() once the message is delivered, or -1
+        if isinstance(topic, str):
+            topic = topic.encode()
+        if isinstance(msg, str):
+            msg = msg.encode()
+        seq = self.seq
+        if not self._record(_ADD, seq, bool(retain) | qos << 1, topic, msg):
+            self.dropped += 1
+            return -1
+        self.seq += 1
+        self._mark(seq)
+        return seq
+
+    def done(self, seq):
+        if self._unmark(seq):
+            # If the delivery record does not fit, the message is just replayed once more
+            self._record(_DONE, seq, 0, b"", b"")
+
+    def _refill(self):
+        now = ticks_ms()
+        elapsed = ticks_diff(now, self.last_refill)
+        per_token = 60000 // self.max_writes_per_min
+        if elapsed >= per_token:
+            self.tokens = min(self.max_writes_per_min, self.tokens + elapsed // per_token)
+            self.last_refill = now
+
+    def _log_size(self):
+        try:
+            return os.stat(self.log_path)[6]
+        except OSError:
+            return 0
+
+    def flush(self, force=False):
+        if not self.batch_len:
+            return True
+        self._refill()
+        if self.tokens < 1 and not force:
+            return False
+        self.tokens -= 1
+        self.writes += 1
+        if not self.pending_count:
+            # Everything was delivered, drop the log instead of appending to it
+            self.batch_len = 0
+            try:
+                os.remove(self.log_path)
+            except OSError:
+                pass
+            return True
+        f = open(self.log_path, "ab")
+        f.write(memoryview(self.batch)[:self.batch_len])
+        f.close()
+        self.batch_len = 0
+        if self._log_size() > self.max_log_size:
+            self.compact()
+        return True
+
+    def compact(self):
+        # Rewrite the log with the undelivered messages only
+        tmp_path = self.path + "/q.tmp"
+        f = open(tmp_path, "wb")
+        header = bytearray(_HDR_LEN)
+        for kind, seq, flags, topic, msg in self._records(self.log_path):
+            if kind == _ADD and self._is_pending(seq):
+                struct.pack_into(_HDR, header, 0, kind, seq, flags, len(topic), len(msg))
+                f.write(header)
+                f.write(topic)
+                f.write(msg)
+        f.close()
+        os.rename(tmp_path, self.log_path)
+        self.compactions += 1
+
+    def replay(self, callback):
+        # Calls callback(seq, topic, msg, retain, qos) for every undelivered message, oldest first
+        self.flush(True)
+        for kind, seq, flags, topic, msg in self._records(self.log_path):
+            if kind == _ADD and self._is_pending(seq):
+                callback(seq, topic, msg, bool(flags & 1), flags >> 1)
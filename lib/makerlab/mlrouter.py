@@ -0,0 +1,93 @@
+def _b(s):
+    return s.encode() if isinstance(s, str) else s
+
+
+class _Node:
+    __slots__ = ("levels", "nodes", "plus", "hash", "handlers")
+
+    def __init__(self):
+        self.levels = [] # Literal levels below this one, nodes[i] is the child for levels[i]
+        self.nodes = []
+        self.plus = None # Child for a "+" level
+        self.hash = [] # Handlers of filters ending in "/#" here
+        self.handlers = [] # Handlers of filters ending exactly here
+
+
+# Dispatches incoming messages to the handlers registered for matching topic filters. Topics
+# are matched as raw bytes: filters without wildcards are looked up in a dict with the topic
+# as received, filters with "+" or "#" are kept in a trie walked level by level in place, so
+# routing a message decodes nothing and allocates no strings.
+#
+# Filters are relative to the prefix given to the constructor unless absolute=True.
+# Handlers are called as handler(topic, msg, retained, duplicate).
+class TopicRouter:
+    def __init__(self, prefix=b""):
+        self.prefix = _b(prefix)
+        self.exact = {}
+        self.root = _Node()
+        self.wildcards = 0
+
+    def add(self, topic_filter, handler, absolute=False):
+        topic_filter = _b(topic_filter)
+        if not absolute:
+            topic_filter = self.prefix + topic_filter
+        if b"+" not in topic_filter and b"#" not in topic_filter:
+            self.exact.setdefault(topic_filter, []).append(handler)
+            return
+        node = self.root
+        levels = topic_filter.split(b"/")
+        for i in range(len(levels)):
+            level = levels[i]
+            if level == b"#":
+                if i != len(levels) - 1:
+                    raise ValueError("# must be the last level")
+                node.hash.append(handler)
+                self.wildcards += 1
+                return
+            if level == b"+":
+                if node.plus is None:
+                    node.plus = _Node()
+                node = node.plus
+            else:
+                try:
+                    node = node.nodes[node.levels.index(level)]
+                except ValueError:
+                    child = _Node()
+                    node.levels.append(level)
+                    node.nodes.append(child)
+                    node = child
+        node.handlers.append(handler)
+        self.wildcards += 1
+
+    def _call(self, handlers, topic, msg, retained, duplicate):
+        for i in range(len(handlers)):
+            handlers[i](topic, msg, retained, duplicate)
+        return len(handlers)
+
+    def _match(self, node, topic, pos, msg, retained, duplicate):
+        # pos is where the current level starts, past the end once every level matched
+        count = self._call(node.hash, topic, msg, retained, duplicate)
+        end = len(topic)
+        if pos > end:
+            return count + self._call(node.handlers, topic, msg, retained, duplicate)
+        stop = topic.find(b"/", pos)
+        if stop < 0:
+            stop = end
+        levels = node.levels
+        for i in range(len(levels)):
+            level = levels[i]
+            if len(level) == stop - pos and topic.startswith(level, pos):
+                count += self._match(node.nodes[i], topic, stop + 1, msg, retained, duplicate)
+        if node.plus is not None:
+            count += self._match(node.plus, topic, stop + 1, msg, retained, duplicate)
+        return count
+
+    # Returns the number of handlers called
+    def dispatch(self, topic, msg, retained=False, duplicate=False):
+        count = 0
+        handlers = self.exact.get(topic)
+        if handlers is not None:
+            count = self._call(handlers, topic, msg, retained, duplicate)
+        if self.wildcards:
+            count += self._match(self.root, topic, 0, msg, retained, duplicate)
+        return count
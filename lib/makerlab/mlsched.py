@@ -0,0 +1,119 @@
+import time
+import random
+
+
+class Task:
+    __slots__ = ("fn", "period", "jitter", "base", "deadline", "active")
+
+    def __init__(self, fn, period, jitter, base):
+        self.fn = fn
+        self.period = period # 0 for one-shot tasks
+        self.jitter = jitter
+        self.base = base # Deadline without jitter, so that the jitter does not accumulate
+        self.deadline = base
+        self.active = True
+
+
+# Cooperative scheduler for the main loop. Tasks run at fixed periods or once at a deadline, and
+# in between the loop sleeps until the next deadline, waking up early when the MQTT socket has
+# data so that commands are handled right away instead of on the next fixed-interval tick.
+#
+# sched = Scheduler(mlha)
+# sched.every(15000, read_and_publish)
+# sched.every(120000, mlha.update_temp_sensor, jitter=5000)
+# sched.run()
+class Scheduler:
+    def __init__(self, mlha=None, mqtt_period=1000):
+        self.mlha = mlha
+        self.tasks = []
+        self.runs = 0
+        self.wakeups = 0
+        self.socket_wakeups = 0
+        if mlha is not None:
+            # Keepalive, send queue and deferred state still need a periodic call without traffic
+            self.every(mqtt_period, self.check_mqtt)
+
+    def _jitter(self, jitter):
+        return random.getrandbits(16) % jitter if jitter else 0
+
+    # Runs fn every period ms, jitter adds a random delay of up to jitter ms to every run
+    def every(self, period, fn, jitter=0, delay=0):
+        task = Task(fn, period, jitter, time.ticks_add(time.ticks_ms(), delay))
+        task.deadline = time.ticks_add(task.base, self._jitter(jitter))
+        self.tasks.append(task)
+        return task
+
+    # Runs fn once, delay ms from now
+    def after(self, delay, fn):
+        task = Task(fn, 0, 0, time.ticks_add(time.ticks_ms(), delay))
+        self.tasks.append(task)
+        return task
+
+    def cancel(self, task):
+        task.active = False
+
+    def check_mqtt(self):
+        # Handles every packet already buffered, not only the one that woke us up
+        mqtt = self.mlha.mqtt
+        left = -1
+        while True:
+            self.mlha.check_mqtt_msg()
+            buffered = len(mqtt.rbuf) if mqtt.sock else 0
+            if not buffered or buffered == left:
+                break
+            left = buffered
+
+    # Runs the due tasks and returns the ms until the next deadline
+    def run_due(self):
+        now = time.ticks_ms()
+        wait = -1
+        i = 0
+        while i < len(self.tasks):
+            task = self.tasks[i]
+            if not task.active:
+                self.tasks.pop(i)
+                continue
+            left = time.ticks_diff(task.deadline, now)
+            if left <= 0:
+                self.runs += 1
+                task.fn()
+                if task.period:
+                    task.base = time.ticks_add(task.base, task.period)
+                    now = time.ticks_ms()
+                    if time.ticks_diff(task.base, now) < 0:
+                        # Fell behind by more than a period, skip the missed runs
+                        task.base = time.ticks_add(now, task.period)
+                    task.deadline = time.ticks_add(task.base, self._jitter(task.jitter))
+                    left = time.ticks_diff(task.deadline, now)
+                else:
+                    task.active = False
+                    self.tasks.pop(i)
+                    continue
+            if wait < 0 or left < wait:
+                wait = left
+            i += 1
+        return wait
+
+    def sleep(self, ms):
+        self.wakeups += 1
+        mqtt = self.mlha.mqtt if self.mlha is not None else None
+        poller = getattr(mqtt, "poller_r", None)
+        if poller is not None and mqtt.sock:
+            if poller.poll(ms):
+                self.socket_wakeups += 1
+                self.check_mqtt()
+                if mqtt.conn_issue:
+                    # A broken socket keeps polling readable, let the reconnect backoff run instead of spinning
+                    time.sleep_ms(ms)
+        elif ms > 0:
+            time.sleep_ms(ms)
+
+    def run_once(self):
+        wait = self.run_due()
+        if wait < 0:
+            wait = 1000
+        self.sleep(wait)
+
+    def run(self):
+        while True:
+            self.run_once()
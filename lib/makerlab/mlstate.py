@@ -0,0 +1,130 @@
+import json
+
+_NULL = b"null"
+_TRUE = b"true"
+_FALSE = b"false"
+_INF = float("inf")
+
+
+# JSON serializer for the state message, compiled once from the state keys. The key fragments
+# are encoded when the encoder is built and values are written digit by digit into a buffer
+# that is reused on every call, so publishing the state does not build a dict, key strings or
+# an output string each cycle. Floats are written with a fixed number of decimals.
+class StateEncoder:
+    def __init__(self, keys, precision=2):
+        self.keys = list(keys)
+        self.index = {}
+        self.fragments = []
+        size = 2
+        for i, key in enumerate(self.keys):
+            self.index[key] = i
+            fragment = (b"{" if i == 0 else b",") + json.dumps(key).encode() + b":"
+            self.fragments.append(fragment)
+            size += len(fragment) + 16
+        self.values = [None] * len(self.keys)
+        self.sent = [None] * len(self.keys) # Values of the last published message
+        self.precision = precision
+        self.scale = 10 ** precision
+        self.buf = bytearray(size)
+        self.mv = memoryview(self.buf)
+        self.view = None # Slice of mv handed out by encode(), reused while the length does not change
+
+    def set(self, key, value):
+        self.values[self.index[key]] = value
+
+    def get(self, key):
+        return self.values[self.index[key]]
+
+    def changed(self):
+        values = self.values
+        sent = self.sent
+        for i in range(len(values)):
+            if values[i] != sent[i]:
+                return True
+        return False
+
+    def mark_sent(self):
+        values = self.values
+        sent = self.sent
+        for i in range(len(values)):
+            sent[i] = values[i]
+
+    def _reserve(self, n):
+        if n > len(self.buf):
+            buf = bytearray(max(n, len(self.buf) * 2))
+            buf[:len(self.buf)] = self.buf
+            self.buf = buf
+            self.mv = memoryview(buf)
+            self.view = None
+
+    def _put(self, pos, data):
+        n = len(data)
+        self._reserve(pos + n)
+        self.buf[pos:pos + n] = data
+        return pos + n
+
+    def _put_int(self, pos, n):
+        if n < 0:
+            pos = self._put(pos, b"-")
+            n = -n
+        digits = 1
+        t = n
+        while t >= 10:
+            t //= 10
+            digits += 1
+        self._reserve(pos + digits)
+        buf = self.buf
+        end = pos + digits
+        while digits:
+            digits -= 1
+            buf[pos + digits] = 48 + n % 10
+            n //= 10
+        return end
+
+    def _put_float(self, pos, value):
+        if value != value or value == _INF or value == -_INF:
+            # Not representable in JSON
+            return self._put(pos, _NULL)
+        scaled = int(value * self.scale + (0.5 if value >= 0 else -0.5))
+        if scaled < 0:
+            pos = self._put(pos, b"-")
+            scaled = -scaled
+        pos = self._put_int(pos, scaled // self.scale)
+        precision = self.precision
+        if precision:
+            self._reserve(pos + 1 + precision)
+            buf = self.buf
+            buf[pos] = 46
+            frac = scaled % self.scale
+            while precision:
+                buf[pos + precision] = 48 + frac % 10
+                frac //= 10
+                precision -= 1
+            pos += 1 + self.precision
+        return pos
+
+    def _put_value(self, pos, value):
+        if value is None:
+            return self._put(pos, _NULL)
+        if value is True:
+            return self._put(pos, _TRUE)
+        if value is False:
+            return self._put(pos, _FALSE)
+        if isinstance(value, int):
+            return self._put_int(pos, value)
+        if isinstance(value, float):
+            return self._put_float(pos, value)
+        # Strings and anything else go through json, they are rare in the state message
+        return self._put(pos, json.dumps(value).encode())
+
+    # Returns a memoryview of the encoded state, valid until the next call
+    def encode(self):
+        pos = 0
+        if not self.keys:
+            pos = self._put(pos, b"{")
+        for i in range(len(self.keys)):
+            pos = self._put_value(self._put(pos, self.fragments[i]), self.values[i])
+        pos = self._put(pos, b"}")
+        if self.view is None or len(self.view) != pos:
+            self.view = self.mv[:pos]
+        return self.view
@@ -0,0 +1,158 @@
+try:import uasyncio as asyncio
+except ImportError:import asyncio
+try:from utime import ticks_ms,ticks_diff
+except ImportError:
+	from time import monotonic
+	def ticks_ms():return int(monotonic()*1000)
+	def ticks_diff(a,b):return a-b
+from . import codec
+from .codec import MQTTException,pid_gen
+from .rxbuf import RxBuffer
+class MQTTClient:
+	DEBUG=False;KEEP_QOS0=True;MSG_QUEUE_MAX=5;RESUBSCRIBE=True;RECONNECT_MAX=60;WBUF_SIZE=128;RBUF_SIZE=256
+	def __init__(A,client_id,server,port=0,user=None,password=None,keepalive=0,ssl=False,ssl_params=None,message_timeout=10):
+		C=ssl_params;B=port
+		if B==0:B=8883 if ssl else 1883
+		A.client_id=client_id;A.server=server;A.port=B;A.user=user;A.pswd=password;A.keepalive=keepalive;A.ssl=ssl;A.ssl_params=C if C else{};A.message_timeout=message_timeout;A.newpid=pid_gen();A.cb=None;A.cbstat=lambda p,s:None;A.lw_topic=None;A.lw_msg=None;A.lw_qos=0;A.lw_retain=False
+		A.reader=None;A.writer=None;A.subs=[];A.msg_to_send=[];A.sub_to_send=[];A.pub_acks={};A.sub_acks={};A.conn_issue=None;A.last_cpacket=ticks_ms();A.tasks=[];A._wbuf=bytearray(A.WBUF_SIZE);A.rbuf=RxBuffer(A.RBUF_SIZE);A._lock=asyncio.Lock();A._kick=asyncio.Event();A._up=asyncio.Event();A._down=asyncio.Event();A.latency=0
+	def set_callback(A,f):A.cb=f
+	def set_callback_status(A,f):A.cbstat=f
+	def set_last_will(A,topic,msg,retain=False,qos=0):B=topic;assert 0<=qos<=2;assert B;A.lw_topic=B;A.lw_msg=msg;A.lw_qos=qos;A.lw_retain=retain
+	def is_connected(A):return A._up.is_set()
+	def is_keepalive(A):
+		B=ticks_diff(ticks_ms(),A.last_cpacket)//1000
+		if 0<A.keepalive<B:A.conn_issue=MQTTException(7),9;return False
+		return A.is_connected()
+	def is_conn_issue(A):
+		A.is_keepalive()
+		if A.conn_issue:A.log()
+		return bool(A.conn_issue)
+	def log(A):
+		if A.DEBUG:
+			if type(A.conn_issue)is tuple:B,C=A.conn_issue
+			else:B=A.conn_issue;C=0
+			D='?','connect','publish','subscribe','reconnect','sendqueue','disconnect','ping','wait_msg','keepalive','check_msg','unsubscribe';print('MQTT (%s): %r'%(D[C],B))
+	def _fail(A,exc,where):
+		A.conn_issue=exc,where;A.log()
+		if A._up.is_set():A._up.clear();A._down.set()
+	async def _send(A,buf,length=-1):
+		B=length;A.writer.write(buf if B<0 else buf[:B])
+		async with A._lock:await A.writer.drain()
+	async def _read_packet(A):
+		while 1:
+			B=A.rbuf.packet()
+			if B:return B
+			C=await A.reader.read(A.RBUF_SIZE)
+			if not C:raise MQTTException(1)
+			A.rbuf.feed(C)
+	async def _close(A):
+		B=A.writer;A.writer=None;A._up.clear()
+		if B:
+			try:B.close();await B.wait_closed()
+			except OSError:pass
+	async def connect(A,clean_session=True):
+		F=clean_session;await A._close();B={'ssl':A.ssl_params.get('context',True)}if A.ssl else{};A.reader,A.writer=await asyncio.open_connection(A.server,A.port,**B);A.rbuf.clear()
+		if F:A.pub_acks.clear();A.sub_acks.clear()
+		await A._send(A._wbuf,codec.connect(A._wbuf,A.client_id,F,A.keepalive,A.user,A.pswd,A.lw_topic,A.lw_msg,A.lw_qos,A.lw_retain));C,E,G=await A._read_packet()
+		if not(C==codec.CONNACK and E==2):raise MQTTException(29)
+		D=A.rbuf.start+G;B=codec.parse_connack(A.rbuf.mv[D:D+E]);A.rbuf.consume(G+E);A.last_cpacket=ticks_ms();A.conn_issue=None;A._down.clear();A._up.set();A._kick.set();return B
+	def start(A):
+		if not A.tasks:A.tasks=[asyncio.create_task(B())for B in(A._reader,A._sender,A._keepalive,A._reconnector)]
+	async def disconnect(A):
+		for B in A.tasks:B.cancel()
+		A.tasks=[]
+		if A._up.is_set():
+			try:await A._send(codec.DISCONNECT)
+			except OSError:pass
+		await A._close()
+	def _done(A,item,status):
+		B=item;B[6]=status
+		if B[5]:B[5].set()
+	def _put(A,item):
+		B=item;C=next(A.newpid)if B[3]else 0
+		if C and type(B[1])not in(str,bytes):B[1]=bytes(B[1])
+		A.writer.write(A._wbuf[:codec.publish(A._wbuf,B[0],B[1],B[2],B[3],B[4],C)])
+		if C:A.pub_acks[C]=B;B[7]=ticks_ms()
+		else:A._done(B,1)
+	def _enqueue(A,item):
+		B=item;C=A.msg_to_send
+		if type(B[1])not in(str,bytes):B[1]=bytes(B[1])
+		if B[2]:
+			for D in[D for D in C if D[2]and D[0]==B[0]]:C.remove(D);A._done(D,2)
+		while len(C)>=A.MSG_QUEUE_MAX:A._done(C.pop(0),2)
+		C.append(B);A._kick.set()
+	def _publish(A,item):
+		B=item
+		if A._up.is_set()and not A.msg_to_send:
+			try:A._put(B);A._kick.set();return
+			except OSError as C:A._fail(C,2)
+		if B[3]or A.KEEP_QOS0 or B[5]:A._enqueue(B)
+		else:A._done(B,2)
+	def publish(A,topic,msg,retain=False,qos=0):assert qos in(0,1);A._publish([topic,msg,retain,qos,False,None,0,0])
+	async def apublish(A,topic,msg,retain=False,qos=0):assert qos in(0,1);B=[topic,msg,retain,qos,False,asyncio.Event(),0,0];A._publish(B);await B[5].wait();return B[6]==1
+	def _subscribe(A,item):
+		B=item
+		if A.RESUBSCRIBE and B[0]not in dict(A.subs):A.subs.append((B[0],B[1]))
+		if A._up.is_set():
+			try:C=next(A.newpid);A.writer.write(A._wbuf[:codec.subscribe(A._wbuf,B[0],B[1],C)]);A.sub_acks[C]=B;A._kick.set();return
+			except OSError as D:A._fail(D,3)
+		A.sub_to_send.append(B);A._kick.set()
+	def subscribe(A,topic,qos=0):assert qos in(0,1);assert A.cb is not None,'Subscribe callback is not set';A._subscribe([topic,qos,False,None,0,None,0])
+	async def asubscribe(A,topic,qos=0):assert qos in(0,1);assert A.cb is not None,'Subscribe callback is not set';B=[topic,qos,False,None,0,asyncio.Event(),0];A._subscribe(B);await B[5].wait();return B[6]==1
+	def unsubscribe(A,topic):
+		B=topic;A.subs[:]=[C for C in A.subs if C[0]!=B];A.sub_to_send[:]=[C for C in A.sub_to_send if C[0]!=B]
+		if A._up.is_set():
+			try:A.writer.write(A._wbuf[:codec.unsubscribe(A._wbuf,(B,),next(A.newpid))]);A._kick.set()
+			except OSError as C:A._fail(C,11)
+	def resubscribe(A):
+		B=[C[0]for C in A.sub_to_send]
+		for (C,D)in A.subs:
+			if C not in B:A._subscribe([C,D,False,None,0,None,0])
+	async def _dispatch(A,packet):
+		B,E,D=packet;J=A.rbuf;G=D+E;D+=J.start;C=J.mv[D:D+E];F=0
+		if B&240==codec.PUBLISH:H,I,F=codec.parse_publish(B,C);H=bytes(H);I=bytes(I)
+		elif B==codec.PUBACK:F=codec.parse_pid(C)
+		elif B==codec.SUBACK:F=codec.parse_suback(C)[0]
+		J.consume(G);del C;A.last_cpacket=ticks_ms()
+		if B&240==codec.PUBLISH:
+			A.cb(H,I,bool(B&1),bool(B&8))
+			if B&6==2:await A._send(A._wbuf,codec.puback(A._wbuf,F))
+		elif B==codec.PUBACK:
+			if F in A.pub_acks:A.latency=ticks_diff(A.last_cpacket,A.pub_acks[F][7]);A.cbstat(F,1);A._done(A.pub_acks.pop(F),1)
+			else:A.cbstat(F,2)
+		elif B==codec.SUBACK:
+			if F in A.sub_acks:A._done(A.sub_acks.pop(F),1);A.cbstat(F,1)
+			else:raise MQTTException(5)
+	async def _reader(A):
+		while 1:
+			await A._up.wait();B=A.reader
+			try:await A._dispatch(await A._read_packet())
+			except (OSError,MQTTException)as C:
+				if B is A.reader:A._fail(C,10)
+	async def _sender(A):
+		while 1:
+			await A._kick.wait();await A._up.wait();A._kick.clear()
+			try:
+				while A.sub_to_send and A._up.is_set():A._subscribe(A.sub_to_send.pop(0))
+				while A.msg_to_send and A._up.is_set():A._put(A.msg_to_send[0]);A.msg_to_send.pop(0)
+				async with A._lock:await A.writer.drain()
+			except (OSError,AttributeError)as B:A._fail(B,5)
+	async def _keepalive(A):
+		while 1:
+			await A._up.wait();B=A.keepalive
+			if not B:await A._down.wait();continue
+			await asyncio.sleep(B/2)
+			if not A._up.is_set():continue
+			if ticks_diff(ticks_ms(),A.last_cpacket)>B*1500:A._fail(MQTTException(7),9);continue
+			try:await A._send(codec.PINGREQ)
+			except OSError as C:A._fail(C,7)
+	async def _reconnector(A):
+		B=1
+		while 1:
+			await A._down.wait();await A._close();C=[A.pub_acks.pop(D)for D in sorted(A.pub_acks)]
+			for D in C:D[4]=True
+			A.msg_to_send[:0]=C;A.sub_to_send[:0]=A.sub_acks.values();A.sub_acks.clear()
+			if A.RESUBSCRIBE:A.resubscribe()
+			await asyncio.sleep(B)
+			try:await asyncio.wait_for(A.connect(False),A.message_timeout);B=1
+			except (OSError,MQTTException,asyncio.TimeoutError)as C:A.conn_issue=C,4;A.log();B=min(B*2,A.RECONNECT_MAX)
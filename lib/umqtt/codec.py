@@ -0,0 +1,98 @@
+CONNECT=16
+CONNACK=32
+PUBLISH=48
+PUBACK=64
+SUBSCRIBE=130
+SUBACK=144
+UNSUBSCRIBE=162
+UNSUBACK=176
+PINGREQ=b'\xc0\x00'
+PINGRESP=208
+DISCONNECT=b'\xe0\x00'
+class MQTTException(Exception):0
+def pid_gen(pid=0):
+	A=pid
+	while True:A=A+1 if A<65535 else 1;yield A
+def _b(s):return s.encode()if isinstance(s,str)else s
+def varlen_size(value):
+	A=value;B=1
+	while A>127:A>>=7;B+=1
+	return B
+def varlen_encode(value,buf,offset=0):
+	B=offset;A=value;assert A<268435456
+	while A>127:buf[B]=A&127|128;A>>=7;B+=1
+	buf[B]=A;return B+1
+def varlen_decode(buf,offset=0,end=-1):
+	E=end;D=buf;B=offset
+	if E<0:E=len(D)
+	A=0;C=0
+	while B<E:
+		F=D[B];A|=(F&127)<<C;B+=1
+		if not F&128:return A,B
+		C+=7
+		if C>21:raise MQTTException(2)
+def _put_str(buf,offset,s):
+	B=offset;C=buf;A=len(s);assert A<65536;C[B]=A>>8;C[B+1]=A&255;B+=2;C[B:B+A]=s;return B+A
+def _grow(buf,n):
+	A=len(buf)
+	if A<n:buf.extend(bytes(max(n,A*2)-A))
+def connect(buf,client_id,clean_session=True,keepalive=0,user=None,pswd=None,lw_topic=None,lw_msg=None,lw_qos=0,lw_retain=False):
+	F=lw_qos;E=keepalive;A=buf;C=[_b(client_id)];D=bytearray(b'\x00\x04MQTT\x04\x00\x00\x00');D[7]=bool(clean_session)<<1
+	if lw_topic:C+=[_b(lw_topic),_b(lw_msg)];D[7]|=4|(F&1)<<3|(F&2)<<3;D[7]|=lw_retain<<5
+	if user is not None:
+		C.append(_b(user));D[7]|=1<<7
+		if pswd is not None:C.append(_b(pswd));D[7]|=1<<6
+	if E:assert E<65536;D[8]=E>>8;D[9]=E&255
+	G=10
+	for H in C:G+=2+len(H)
+	_grow(A,1+varlen_size(G)+G);A[0]=CONNECT;B=varlen_encode(G,A,1);A[B:B+10]=D;B+=10
+	for H in C:B=_put_str(A,B,H)
+	return B
+def publish(buf,topic,msg,retain=False,qos=0,dup=False,pid=0):
+	D=qos;A=buf;E=_b(topic);F=_b(msg);C=2+len(E)+len(F)
+	if D>0:C+=2
+	_grow(A,1+varlen_size(C)+C);A[0]=PUBLISH|D<<1|retain|int(dup)<<3;B=varlen_encode(C,A,1);B=_put_str(A,B,E)
+	if D>0:A[B]=pid>>8;A[B+1]=pid&255;B+=2
+	C=len(F);A[B:B+C]=F;return B+C
+def subscribe_many(buf,topics,pid):
+	A=buf;D=[(_b(E),F)for(E,F)in topics];C=2
+	for (E,F) in D:C+=3+len(E)
+	_grow(A,1+varlen_size(C)+C);A[0]=SUBSCRIBE;B=varlen_encode(C,A,1);A[B]=pid>>8;A[B+1]=pid&255;B+=2
+	for (E,F) in D:B=_put_str(A,B,E);A[B]=F;B+=1
+	return B
+def subscribe(buf,topic,qos,pid):return subscribe_many(buf,((topic,qos),),pid)
+def unsubscribe(buf,topics,pid):
+	A=buf;D=[_b(E)for E in topics];C=2
+	for E in D:C+=2+len(E)
+	_grow(A,1+varlen_size(C)+C);A[0]=UNSUBSCRIBE;B=varlen_encode(C,A,1);A[B]=pid>>8;A[B+1]=pid&255;B+=2
+	for E in D:B=_put_str(A,B,E)
+	return B
+def puback(buf,pid):A=buf;_grow(A,4);A[0]=PUBACK;A[1]=2;A[2]=pid>>8;A[3]=pid&255;return 4
+def header(buf,offset=0,end=-1):
+	C=end;B=buf;A=offset
+	if C<0:C=len(B)
+	if A>=C:return
+	D=varlen_decode(B,A+1,C)
+	if D is None:return
+	return B[A],D[0],D[1]-A
+def parse_connack(body):
+	A=body
+	if len(A)!=2:raise MQTTException(29)
+	if A[1]!=0:
+		if 1<=A[1]<=5:raise MQTTException(20+A[1])
+		else:raise MQTTException(20,A[1])
+	return A[0]&1
+def parse_pid(body,offset=0):return body[offset]<<8|body[offset+1]
+def parse_suback(body):
+	A=body
+	if len(A)<3:raise MQTTException(40,bytes(A))
+	B=bytes(A[2:]);C=0
+	for D in B:
+		if D==128:C+=1
+		elif D not in(0,1,2):raise MQTTException(40,bytes(A))
+	if C==len(B):raise MQTTException(44)
+	return parse_pid(A),B
+def parse_publish(flags,body):
+	C=body;B=C[0]<<8|C[1];D=C[2:2+B];A=2+B;E=0
+	if flags&6:E=parse_pid(C,A);A+=2
+	return D,C[A:],E
@@ -1,61 +1,139 @@
 from utime import ticks_ms,ticks_diff
 from .  import simple2
+def _own(msg):return msg if type(msg)in(str,bytes)else bytes(msg)
+class MsgQueue:
+	def __init__(A,capacity):A.cap=0;A.n=0;A.head=0;A.dead=0;A.n1=0;A.index={};A.resize(capacity)
+	def __len__(A):return A.n-A.dead
+	def resize(A,capacity):
+		C=capacity;B=[A.get(D)for D in range(A.n)if not A.flags[(A.head+D)%A.cap]&8];A.cap=C;A.topics=[None]*C;A.msgs=[None]*C;A.flags=bytearray(C);A.clear()
+		for D in B[max(0,len(B)-C):]:A.push(*D)
+	def clear(A):
+		for B in range(A.cap):A.topics[B]=None;A.msgs[B]=None;A.flags[B]=0
+		A.n=0;A.head=0;A.dead=0;A.n1=0;A.index.clear()
+	def peek(A):return A.head
+	def get(A,i):B=(A.head+i)%A.cap;C=A.flags[B];return A.topics[B],A.msgs[B],bool(C&1),C>>1&1,bool(C&4)
+	def _set(A,slot,topic,msg,retain,qos,coalesce):B=slot;A.n1+=qos-(A.flags[B]>>1&1);A.topics[B]=topic;A.msgs[B]=_own(msg);A.flags[B]=bool(retain)|qos<<1|bool(coalesce)<<2
+	def _room(A):
+		if A.n<A.cap:return True
+		if A.dead:A.resize(A.cap);return True
+		return False
+	def push(A,topic,msg,retain=False,qos=0,coalesce=False):
+		if not A._room():return False
+		B=(A.head+A.n)%A.cap;A._set(B,topic,msg,retain,qos,coalesce);A.n+=1;A.index[topic]=B;return True
+	def push_front(A,topic,msg,retain=False,qos=0,coalesce=False):
+		C=topic
+		if not A._room():return False
+		A.head=B=(A.head-1)%A.cap;A._set(B,C,msg,retain,qos,coalesce);A.n+=1
+		if C not in A.index:A.index[C]=B
+		return True
+	def _drop(A):
+		B=A.head;C=A.topics[B]
+		if A.index.get(C)==B:A.index.pop(C)
+		A.n1-=A.flags[B]>>1&1;A.topics[B]=None;A.msgs[B]=None;A.flags[B]=0;A.head=(B+1)%A.cap;A.n-=1
+	def pop(A):
+		A._drop()
+		while A.n and A.flags[A.head]&8:A._drop();A.dead-=1
+	def replace(A,topic,msg,retain=False,qos=0,coalesce=False):
+		B=A.index.get(topic)
+		if B is None or not(retain and A.flags[B]&1 or coalesce and A.flags[B]&4):return False
+		A._set(B,topic,msg,retain,qos,coalesce);return True
+	def remove(A,topic,retain=False,coalesce=False):
+		B=A.index.get(topic)
+		if B is None or not(retain and A.flags[B]&1 or coalesce and A.flags[B]&4):return False
+		if B==A.head:A.pop();return True
+		A.index.pop(topic);A.n1-=A.flags[B]>>1&1;A.topics[B]=None;A.msgs[B]=None;A.flags[B]=8;A.dead+=1;return True
+	def has_qos1(A):return A.n1>0
+	def contains(A,topic,msg,retain=False,qos=0):B=A.index.get(topic);return B is not None and A.flags[B]&3==bool(retain)|qos<<1 and A.msgs[B]==msg
 class MQTTClient(simple2.MQTTClient):
-	DEBUG=False;KEEP_QOS0=True;NO_QUEUE_DUPS=True;MSG_QUEUE_MAX=5;CONFIRM_QUEUE_MAX=10;RESUBSCRIBE=True
-	def __init__(A,*B,**C):super().__init__(*B,**C);A.subs=[];A.msg_to_send=[];A.sub_to_send=[];A.msg_to_confirm={};A.sub_to_confirm={};A.conn_issue=None
+	DEBUG=False;KEEP_QOS0=True;NO_QUEUE_DUPS=True;MSG_QUEUE_MAX=5;CONFIRM_QUEUE_MAX=10;INFLIGHT_MAX=0;RESUBSCRIBE=True
+	def __init__(A,*B,**C):super().__init__(*B,**C);A.subs=[];A.msg_to_send=MsgQueue(A.MSG_QUEUE_MAX);A.coalesce=set();A.sub_to_send=[];A.granted={};A.msg_to_confirm={};A.sub_to_confirm={};A.pids={};A.n_confirm=0;A.oldest=0;A.conn_issue=None;A.timed_out=None;A.dropped=0
 	def is_keepalive(A):
 		B=ticks_diff(ticks_ms(),A.last_cpacket)//1000
 		if 0<A.keepalive<B:A.conn_issue=simple2.MQTTException(7),9;return False
 		return True
 	def set_callback_status(A,f):A._cbstat=f
+	def set_callback_suback(A,f):A._cbsub=f
+	def cbsub(A,pid,codes):
+		B=A.pids.get(pid)
+		if B and B[0]:
+			for ((C,D),E) in zip(B[1],codes):A.granted[C]=E
+		try:A._cbsub(pid,codes)
+		except AttributeError:pass
+	def _confirm(A,kind,key,pid):
+		C=pid;B=(A.msg_to_confirm,A.sub_to_confirm)[kind].setdefault(key,[]);B.append(C);A.pids[C]=kind,key
+		if not kind:
+			if not A.n_confirm:A.oldest=C
+			A.n_confirm+=1
+		if len(B)>A.CONFIRM_QUEUE_MAX:A._unconfirm(B[0])
+	def _unconfirm(A,pid,whole=False):
+		C=pid;B=A.pids.pop(C,None)
+		if B is None:return
+		E,F=B;G=(A.msg_to_confirm,A.sub_to_confirm)[E];D=G[F]
+		if whole:
+			for H in D:
+				if H!=C:A.pids.pop(H,None)
+			I=len(D);D.clear()
+		else:D.remove(C);I=1
+		if not E:A.n_confirm-=I
+		if not D:G.pop(F)
+		return B
+	def _oldest_msg_pid(A):
+		if not A.n_confirm:return 0
+		B=A.oldest
+		while 1:
+			C=A.pids.get(B)
+			if C and not C[0]:A.oldest=B;return B
+			B=B+1 if B<65535 else 1
 	def cbstat(A,pid,stat):
 		E=stat;D=pid
 		try:A._cbstat(D,E)
 		except AttributeError:pass
-		for (B,C) in A.msg_to_confirm.items():
-			if D in C:
-				if E==0:
-					if B not in A.msg_to_send:A.msg_to_send.insert(0,B)
-					C.remove(D)
-					if not C:A.msg_to_confirm.pop(B)
-				elif E in(1,2):A.msg_to_confirm.pop(B)
-				return
-		for (B,C) in A.sub_to_confirm.items():
-			if D in C:
-				if E==0:
-					if B not in A.sub_to_send:A.sub_to_send.append(B)
-					C.remove(D)
-					if not C:A.sub_to_confirm.pop(B)
-				elif E in(1,2):A.sub_to_confirm.pop(B)
+		if E==0:
+			B=A._unconfirm(D)
+			if B is None:return
+			C,F=B
+			if C:
+				for G in F:
+					if G not in A.sub_to_send:A.sub_to_send.append(G)
+			elif not A.msg_to_send.contains(*F):
+				if A.timed_out is None:A._requeue(F)
+				else:A.timed_out.append(F)
+		elif E in(1,2):A._unconfirm(D,True)
+	def _message_timeout(A):
+		B=A.timed_out=[];super()._message_timeout();A.timed_out=None
+		while B:A._requeue(B.pop())
+	def _requeue(A,data):
+		B=data
+		if not A.msg_to_send.push_front(*B,coalesce=B[0]in A.coalesce):A.dropped+=1
 	def connect(A,clean_session=True):
 		B=clean_session
-		if B:A.msg_to_send[:]=[];A.msg_to_confirm.clear()
+		if B:
+			A.msg_to_send.clear();A.msg_to_confirm.clear();A.n_confirm=0
+			for C in[C for(C,D)in A.pids.items()if not D[0]]:A.pids.pop(C)
 		try:C=super().connect(B);A.conn_issue=None;return C
 		except (OSError,simple2.MQTTException)as D:A.conn_issue=D,1
 	def log(A):
 		if A.DEBUG:
 			if type(A.conn_issue)is tuple:B,C=A.conn_issue
 			else:B=A.conn_issue;C=0
-			D='?','connect','publish','subscribe','reconnect','sendqueue','disconnect','ping','wait_msg','keepalive','check_msg';print('MQTT (%s): %r'%(D[C],B))
+			D='?','connect','publish','subscribe','reconnect','sendqueue','disconnect','ping','wait_msg','keepalive','check_msg','unsubscribe';print('MQTT (%s): %r'%(D[C],B))
 	def reconnect(A):
 		try:B=super().connect(False);A.conn_issue=None;return B
 		except (OSError,simple2.MQTTException)as C:
 			A.conn_issue=C,4
 			if A.sock:A.sock.close();A.sock=None
-	def resubscribe(A):
-		for (B,C) in A.subs:A.subscribe(B,C,False)
+	def resubscribe(A):A.subscribe_many(A.subs,False)
 	def add_msg_to_send(A,data):
-		C=len(A.msg_to_send);C+=sum(map(len,A.msg_to_confirm.values()))
-		while C>=A.MSG_QUEUE_MAX:
-			E=min(map(lambda x:x[0]if x else 65535,A.msg_to_confirm.values()),default=0)
-			if 0<E<65535:
-				B=None
-				for (F,D) in A.msg_to_confirm.items():
-					if D and D[0]==E:del D[0];B=F;break
-				if B and B in A.msg_to_confirm and not A.msg_to_confirm[B]:A.msg_to_confirm.pop(B)
-			else:A.msg_to_send.pop(0)
-			C-=1
-		A.msg_to_send.append(data)
+		B=A.msg_to_send;C,D,E,F=data;G=C in A.coalesce
+		if B.cap!=A.MSG_QUEUE_MAX:B.resize(A.MSG_QUEUE_MAX)
+		if B.replace(C,D,E,F,G):return
+		H=len(B)+A.n_confirm
+		while H>=A.MSG_QUEUE_MAX:
+			I=A._oldest_msg_pid()
+			if I:A._unconfirm(I)
+			else:B.pop();A.dropped+=1
+			H-=1
+		B.push(C,D,E,F,G)
 	def disconnect(A):
 		try:return super().disconnect()
 		except (OSError,simple2.MQTTException)as B:A.conn_issue=B,6
@@ -64,49 +142,59 @@ class MQTTClient(simple2.MQTTClient):
 		try:return super().ping()
 		except (OSError,simple2.MQTTException)as B:A.conn_issue=B,7
 	def publish(A,topic,msg,retain=False,qos=0):
-		E=topic;D=retain;B=qos;C=E,msg,D,B
-		if D:A.msg_to_send[:]=[B for B in A.msg_to_send if not(E==B[0]and D==B[2])]
+		E=topic;D=retain;B=qos
+		if B:msg=_own(msg)
+		C=E,msg,D,B
+		if B==1 and(A.window_full()or A.msg_to_send.has_qos1()):
+			if not(A.NO_QUEUE_DUPS and A.msg_to_send.contains(*C)):A.add_msg_to_send(C)
+			return
 		try:
 			F=super().publish(E,msg,D,B,False)
-			if B==1:
-				A.msg_to_confirm.setdefault(C,[]).append(F)
-				if len(A.msg_to_confirm[C])>A.CONFIRM_QUEUE_MAX:A.msg_to_confirm.pop(0)
+			if B==1:A._confirm(0,C,F)
+			if D or E in A.coalesce:A.msg_to_send.remove(E,D,E in A.coalesce)
 			return F
 		except (OSError,simple2.MQTTException)as G:
 			A.conn_issue=G,2
 			if A.NO_QUEUE_DUPS:
-				if C in A.msg_to_send:return
+				if A.msg_to_send.contains(*C):return
 			if A.KEEP_QOS0 and B==0:A.add_msg_to_send(C)
 			elif B==1:A.add_msg_to_send(C)
-	def subscribe(A,topic,qos=0,resubscribe=True):
-		C=topic;B=C,qos
+	def window_full(A):return 0<A.INFLIGHT_MAX<=A.n_confirm
+	def subscribe(A,topic,qos=0,resubscribe=True):return A.subscribe_many(((topic,qos),),resubscribe)
+	def subscribe_many(A,topics,resubscribe=True):
+		B=tuple((C,D)for(C,D)in topics)
+		if not B:return
+		E=dict(B)
 		if A.RESUBSCRIBE and resubscribe:
-			if C not in dict(A.subs):A.subs.append(B)
-		A.sub_to_send[:]=[B for B in A.sub_to_send if C!=B[0]]
+			F=dict(A.subs)
+			for C in B:
+				if C[0]not in F:A.subs.append(C);F[C[0]]=C[1]
+		A.sub_to_send[:]=[C for C in A.sub_to_send if C[0]not in E]
 		try:
-			D=super().subscribe(C,qos);A.sub_to_confirm.setdefault(B,[]).append(D)
-			if len(A.sub_to_confirm[B])>A.CONFIRM_QUEUE_MAX:A.sub_to_confirm.pop(0)
-			return D
-		except (OSError,simple2.MQTTException)as E:
-			A.conn_issue=E,3
-			if A.NO_QUEUE_DUPS:
-				if B in A.sub_to_send:return
-			A.sub_to_send.append(B)
+			D=super().subscribe_many(B);A._confirm(1,B,D);return D
+		except (OSError,simple2.MQTTException)as G:A.conn_issue=G,3;A.sub_to_send.extend(B)
+	def unsubscribe(A,topic):return A.unsubscribe_many((topic,))
+	def unsubscribe_many(A,topics):
+		B=tuple(topics)
+		A.subs[:]=[C for C in A.subs if C[0]not in B];A.sub_to_send[:]=[C for C in A.sub_to_send if C[0]not in B]
+		for C in B:A.granted.pop(C,None)
+		try:return super().unsubscribe_many(B)
+		except (OSError,simple2.MQTTException)as D:A.conn_issue=D,11
 	def send_queue(A):
-		D=[]
-		for B in A.msg_to_send:
-			E,I,J,C=B
-			try:
-				F=super().publish(E,I,J,C,False)
-				if C==1:A.msg_to_confirm.setdefault(B,[]).append(F)
-				D.append(B)
+		D=A.msg_to_send
+		while len(D):
+			B=D.peek();E=D.topics[B];I=D.msgs[B];J=bool(D.flags[B]&1);C=D.flags[B]>>1&1
+			if C==1 and A.window_full():break
+			try:F=super().publish(E,I,J,C,False)
 			except (OSError,simple2.MQTTException)as G:A.conn_issue=G,5;return False
-		A.msg_to_send[:]=[B for B in A.msg_to_send if B not in D];del D;H=[]
-		for B in A.sub_to_send:
-			E,C=B
-			try:F=super().subscribe(E,C);A.sub_to_confirm.setdefault(B,[]).append(F);H.append(B)
+			if C==1:A._confirm(0,(E,I,J,C),F)
+			D.pop()
+		if A.sub_to_send:
+			H=tuple(A.sub_to_send)
+			try:F=super().subscribe_many(H);A._confirm(1,H,F)
 			except (OSError,simple2.MQTTException)as G:A.conn_issue=G,5;return False
-		A.sub_to_send[:]=[B for B in A.sub_to_send if B not in H];return True
+			A.sub_to_send[:]=[B for B in A.sub_to_send if B not in H]
+		return True
 	def is_conn_issue(A):
 		A.is_keepalive()
 		if A.conn_issue:A.log()
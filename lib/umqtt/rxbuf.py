@@ -0,0 +1,36 @@
+from .codec import header
+class RxBuffer:
+	def __init__(A,capacity=256):A.buf=bytearray(capacity);A.mv=memoryview(A.buf);A.start=0;A.end=0;A.pending=None;A.allocs=1;A.compacts=0;A.reads=0
+	def __len__(A):return A.end-A.start
+	def clear(A):A.start=0;A.end=0;A.pending=None
+	def consume(A,n):
+		A.start+=n
+		if A.start>=A.end:A.start=0;A.end=0
+	def reserve(A,n):
+		B=len(A.buf)
+		if n>B:C=bytearray(max(n,B*2));D=A.end-A.start;C[:D]=A.mv[A.start:A.end];A.buf=C;A.mv=memoryview(C);A.start=0;A.end=D;A.allocs+=1
+	def packet(A):
+		B=A.pending
+		if B is None:
+			B=header(A.buf,A.start,A.end)
+			if B is None:return
+			A.reserve(B[1]+B[2]);A.pending=B
+		if A.end-A.start<B[1]+B[2]:return
+		A.pending=None;return B
+	def _compact(A):
+		B=A.start;C=A.end-B;D=0
+		while D<C:E=min(B,C-D);A.buf[D:D+E]=A.mv[B+D:B+D+E];D+=E
+		A.start=0;A.end=C;A.compacts+=1
+	def feed(A,data):
+		B=len(data)
+		if A.end+B>len(A.buf):
+			if A.start:A._compact()
+			A.reserve(A.end+B)
+		A.buf[A.end:A.end+B]=data;A.end+=B;A.reads+=1
+	def fill(A,sock):
+		if A.end==len(A.buf):
+			if A.start:A._compact()
+			else:A.reserve(A.end+1)
+		B=sock.readinto(A.mv[A.end:])
+		if B:A.end+=B;A.reads+=1
+		return B
@@ -24,8 +24,10 @@
 import json
 from secrets import wifi_SSID, wifi_password, mqtt_server, mqtt_port, mqtt_user, mqtt_password
 from makerlab.mlha import MLHA 
-from machine import Pin, Timer
-import time
+from makerlab.mlsched import Scheduler
+from makerlab.mlinput import InputEvents
+import machine
+from machine import Pin
 import gc
 
 # Pins definition ===================================
@@ -67,13 +69,21 @@ def setup_config():
     mlha.publish_config("activator", "Activador simple", "binary_sensor", "running", expire_after = 140)
     mlha.publish_config("mlactivator_connection", "MLActivator Connection", "binary_sensor", "connectivity", expire_after = 140)
 
-def button_pressed(pin):
-    push_button.irq(trigger=Pin.IRQ_RISING, handler=None)
+# Runs in the main loop, the interrupt only records the edge
+activator_on = False
+def button_pressed():
+    global activator_on
+    if activator_on:
+        return
     print("Button pressed")
+    activator_on = True
     mlha.publish_status(parse_message(True))
-    time.sleep(2)
+    sched.after(2000, button_released)
+
+def button_released():
+    global activator_on
+    activator_on = False
     mlha.publish_status(parse_message())
-    push_button.irq(trigger=Pin.IRQ_RISING, handler=button_pressed)
     
 
 # Main =============================================
@@ -86,7 +96,8 @@ mlha.set_enable_temp_sensor(True)
 # Initialise push button and its interrupt
 print("Initializing push button")
 push_button = Pin(button_pin, Pin.IN, Pin.PULL_DOWN)
-push_button.irq(trigger=Pin.IRQ_RISING, handler=button_pressed)
+inputs = InputEvents()
+inputs.button(push_button, on_press=button_pressed)
 
 # Initialise LEDs
 print("Initializing LEDs")
@@ -104,23 +115,19 @@ print("Publishing config to Homeassistant")
 setup_config() # Publishes the config for Homeassistant
 
 print("Starting values read and publish timer")
-# Send ping to broker every 2 minutes
-send_tim = Timer()
-send_tim.init(period=120000, mode=Timer.PERIODIC, callback=lambda t:mlha.publish_status(parse_message()))
 mlha.publish_status(parse_message())
 print("Initialization complete, free memory: " + str(gc.mem_free()))
 print("Ready to send/receive data")
 mlha.publish("system/status", "online", retain=True)
 
 # Main loop
-last_update = time.ticks_ms()
-while True:
-    try:
-        mlha.check_mqtt_msg()
-        if time.ticks_diff(time.ticks_ms(), last_update) > 120000: # 2 minutes
-            last_update = time.ticks_ms()
-            mlha.update_temp_sensor()
-        time.sleep_ms(250)
-    except Exception as ex:
-        print("error: " + str(ex))
-        machine.reset()
+# Send status to broker every 2 minutes
+sched = Scheduler(mlha)
+inputs.schedule(sched)
+sched.every(120000, lambda: mlha.publish_status(parse_message(activator_on)), delay=120000)
+sched.every(120000, mlha.update_temp_sensor, delay=120000)
+try:
+    sched.run()
+except Exception as ex:
+    print("error: " + str(ex))
+    machine.reset()
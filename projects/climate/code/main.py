@@ -14,11 +14,14 @@
 # 6. Sets up a timer to read the temperature from the sensors and publish it to MQTT.
 #
 
-import json
 from secrets import wifi_SSID, wifi_password, mqtt_server, mqtt_port, mqtt_user, mqtt_password
 from makerlab.mlha import MLHA 
+from makerlab.mlentity import Sensor, BinarySensor, Switch
+from makerlab.mlds18x20 import DS18B20Engine
+from makerlab.mlfilter import Pipeline, Reject, Range, Deadband
+from makerlab.mlsched import Scheduler
+import machine
 from machine import Pin
-import onewire, ds18x20
 import time
 import gc
 
@@ -37,159 +40,28 @@ relay_gen3_pin = 11 # GPIO pin for relay
 relay_gen4_pin = 8 # GPIO pin for relay
 pir_pin = 18 # GPIO pin for the PIR sensor
 
-ds_caldera_sensor = None  # caldera temperature sensor object (Dallas)
-ds_deposito_sensor = None # depositotemperature sensor object (Dallas)
-ds_casa_sensor = None  # casa temperature sensor object (Dallas)
-ds_exterior_sensor = None # exterior temperature sensor object (Dallas)
-relay_caldera = None # relay for caldera
-relay_acs = None # relay for acs
-relay_primerod = None # relay for primerod
-relay_garaje = None # relay for garaje
-relay_gen1 = None # relay
-relay_gen2 = None # relay
-relay_gen3 = None # relay
-relay_gen4 = None # relay
-temperatura_caldera = None # temperatura caldera
-temperatura_deposito = None # temperatura deposito
-temperatura_casa = None # temperatura casa
-temperatura_exterior = None # temperatura exterior
+temperatures = DS18B20Engine() # Reads all the DS18B20 sensors in parallel without blocking the loop
+temperature_sensors = [] # (name, DS18B20 probe, Sensor entity, filter pipeline)
 pir_sensor = None # PIR sensor object
 mlha = None # WiFi, MQTT and HomeAssistant library
 
 # Functions =========================================
+# Called once the readings started by temperatures.start() are all in
 def getTemperature():
-    global temperatura_caldera
-    global temperatura_deposito
-    global temperatura_casa
-    global temperatura_exterior
-    try:
-        caldera_sensor_id = ds_caldera_sensor.scan()[0]
-        ds_caldera_sensor.convert_temp()
-        temperatura_caldera = ds_caldera_sensor.read_temp(caldera_sensor_id)
-    except Exception as e:
-        print("Error getting caldera temperature: " + str(e))
-    try:
-        deposito_sensor_id = ds_deposito_sensor.scan()[0]
-        ds_deposito_sensor.convert_temp()
-        temperatura_deposito = ds_deposito_sensor.read_temp(deposito_sensor_id)
-    except Exception as e:
-        print("Error getting deposito temperature: " + str(e))
-    try:
-        casa_sensor_id = ds_casa_sensor.scan()[0]
-        ds_casa_sensor.convert_temp()
-        temperatura_casa = ds_casa_sensor.read_temp(casa_sensor_id)
-    except Exception as e:
-        print("Error getting casa temperature: " + str(e))
-    try:
-        exterior_sensor_id = ds_exterior_sensor.scan()[0]
-        ds_exterior_sensor.convert_temp()
-        temperatura_exterior = ds_exterior_sensor.read_temp(exterior_sensor_id)
-    except Exception as e:
-        print("Error getting exterior temperature: " + str(e))
-    
-    # Check temperature values are valid
-    if temperatura_caldera is not None:
-        if temperatura_caldera == 85.0:
-            temperatura_caldera = None
-        elif temperatura_caldera < 0 or temperatura_caldera > 100:
-            temperatura_caldera = None
-    if temperatura_deposito is not None:
-        if temperatura_deposito == 85.0:
-            temperatura_deposito = None
-        elif temperatura_deposito < 0 or temperatura_deposito > 90:
-            temperatura_deposito = None
-    if temperatura_casa is not None:
-        if temperatura_casa < -10 or temperatura_casa > 60:
-            temperatura_casa = None
-    if temperatura_exterior is not None:
-        if temperatura_exterior < -30 or temperatura_exterior > 70:
-            temperatura_exterior = None
+    for name, probe, entity, pipeline in temperature_sensors:
+        if probe.value is None:
+            print("Error getting " + name + " temperature")
+            # Keep the last good value, the engine rescans the bus on the next cycle
+        else:
+            # None if the reading is not valid
+            entity.set(pipeline(probe.value))
 
 def msg_received(topic, msg, retained, duplicate):
-    if topic == "system/status":
-        mlha.publish("system/status", "online")
-    elif topic == "switch/toggle/caldera_status":
-        if msg == b"True":
-            relay_caldera.value(0)
-        elif msg == b"False":
-            relay_caldera.value(1)
-    elif topic == "switch/toggle/acs_status":
-        if msg == b"True":
-            relay_acs.value(0)
-        elif msg == b"False":
-            relay_acs.value(1)
-    elif topic == "switch/toggle/primerod_status":
-        if msg == b"True":
-            relay_primerod.value(0)
-        elif msg == b"False":
-            relay_primerod.value(1)
-    elif topic == "switch/toggle/garaje_status":
-        if msg == b"True":
-            relay_garaje.value(0)
-        elif msg == b"False":
-            relay_garaje.value(1)
-    elif topic == "switch/toggle/gen1_status":
-        if msg == b"True":
-            relay_gen1.value(0)
-        elif msg == b"False":
-            relay_gen1.value(1)
-    elif topic == "switch/toggle/gen2_status":
-        if msg == b"True":
-            relay_gen2.value(0)
-        elif msg == b"False":
-            relay_gen2.value(1)
-    elif topic == "switch/toggle/gen3_status":
-        if msg == b"True":
-            relay_gen3.value(0)
-        elif msg == b"False":
-            relay_gen3.value(1)
-    elif topic == "switch/toggle/gen4_status":
-        if msg == b"True":
-            relay_gen4.value(0)
-        elif msg == b"False":
-            relay_gen4.value(1)
-    else:
-        print("Unknown topic")
-    mlha.publish_status(parse_message())
-
-def parse_message():
-    extracted_data = {"caldera_temp": temperatura_caldera,
-                      "casa_temp": temperatura_casa,
-                      "exterior_temp": temperatura_exterior,
-                      "deposito_temp": temperatura_deposito,
-                      "caldera_status": relay_caldera.value() == 0,
-                      "acs_status": relay_acs.value() == 0,
-                      "primerod_status": relay_primerod.value() == 0,
-                      "garaje_status": relay_garaje.value() == 0,
-                      "gen1_status": relay_gen1.value() == 0,
-                      "gen2_status": relay_gen2.value() == 0,
-                      "gen3_status": relay_gen3.value() == 0,
-                      "gen4_status": relay_gen4.value() == 0,
-                      "mltemp_connection": True}
-
-    return extracted_data
-
+    print("Unknown topic")
 
 def read_and_publish():
     getTemperature()
-    mlha.publish_status(parse_message())
-
-# Publishes the config for the sensors to Homeassistant
-def setup_config():
-    mlha.publish_config("caldera_temp", "Temperatura de la Caldera", "sensor", "temperature", None, "measurement", expire_after = 60)
-    mlha.publish_config("casa_temp", "Temperatura de Casa", "sensor", "temperature", None, "measurement", expire_after = 60)
-    mlha.publish_config("exterior_temp", "Temperatura Exterior", "sensor", "temperature", None, "measurement", expire_after = 60)
-    mlha.publish_config("deposito_temp", "Temperatura del Deposito", "sensor", "temperature", None, "measurement", expire_after = 60)
-    mlha.publish_config("caldera_status", "Estado de la caldera", "switch", expire_after = 60)
-    mlha.publish_config("acs_status", "Estado del ACS", "switch", expire_after = 60)
-    mlha.publish_config("primerod_status", "Estado del Primero D", "switch", expire_after = 60)
-    mlha.publish_config("garaje_status", "Estado del Garaje", "switch", expire_after = 60)
-    mlha.publish_config("cuadra_motion", "Movimiento en la cuadra", "binary_sensor", "motion", state_topic = "/motion", expire_after = 60)
-    mlha.publish_config("mltemp_connection", "MLTemp Connection", "binary_sensor", "connectivity", expire_after = 60)
-    mlha.publish_config("gen1_status", "Estado del rele gen 1", "switch", expire_after = 60)
-    mlha.publish_config("gen2_status", "Estado del rele gen 2", "switch", expire_after = 60)
-    mlha.publish_config("gen3_status", "Estado del rele gen 3", "switch", expire_after = 60)
-    mlha.publish_config("gen4_status", "Estado del rele gen 4", "switch", expire_after = 60)
+    mlha.publish_status()
 
 # Main =============================================
 # Initialize main component (WiFi, MQTT and HomeAssistant)
@@ -197,78 +69,75 @@ mlha = MLHA(wifi_SSID, wifi_password, mqtt_server, mqtt_port, mqtt_user, mqtt_pa
 mlha.set_callback(msg_received)
 mlha.set_device_name("MLCasaClimate")
 
+# Entities publish their config to Homeassistant, subscribe to their commands and report their state by themselves
+print("Publishing config to Homeassistant")
+
 # Initialise temperature sensors
 print("Initializing temperature sensors")
-ds_caldera_sensor = ds18x20.DS18X20(onewire.OneWire(machine.Pin(ds_caldera_pin)))
-ds_deposito_sensor = ds18x20.DS18X20(onewire.OneWire(machine.Pin(ds_deposito_pin)))
-ds_casa_sensor = ds18x20.DS18X20(onewire.OneWire(machine.Pin(ds_casa_pin)))
-ds_exterior_sensor = ds18x20.DS18X20(onewire.OneWire(machine.Pin(ds_exterior_pin)))
-
-# Initialise Relays
+temperature_sensors = [
+    ("caldera", temperatures.add(ds_caldera_pin), Sensor(mlha, "caldera_temp", "Temperatura de la Caldera", None, "temperature", None, "measurement"), Pipeline(Reject(85.0), Range(0, 100), Deadband(0.125))),
+    ("casa", temperatures.add(ds_casa_pin), Sensor(mlha, "casa_temp", "Temperatura de Casa", None, "temperature", None, "measurement"), Pipeline(Range(-10, 60), Deadband(0.125))),
+    ("exterior", temperatures.add(ds_exterior_pin), Sensor(mlha, "exterior_temp", "Temperatura Exterior", None, "temperature", None, "measurement"), Pipeline(Range(-30, 70), Deadband(0.125))),
+    ("deposito", temperatures.add(ds_deposito_pin), Sensor(mlha, "deposito_temp", "Temperatura del Deposito", None, "temperature", None, "measurement"), Pipeline(Reject(85.0), Range(0, 90), Deadband(0.125))),
+]
+
+# Initialise Relays, they are active low and start off
 print("Initializing relays")
-relay_caldera = Pin(relay_caldera_pin, Pin.OUT)
-relay_acs = Pin(relay_acs_pin, Pin.OUT)
-relay_primerod = Pin(relay_primerod_pin, Pin.OUT)
-relay_garaje = Pin(relay_garaje_pin, Pin.OUT)
-relay_gen1 = Pin(relay_gen1_pin, Pin.OUT)
-relay_gen2 = Pin(relay_gen2_pin, Pin.OUT)
-relay_gen3 = Pin(relay_gen3_pin, Pin.OUT)
-relay_gen4 = Pin(relay_gen4_pin, Pin.OUT)
-relay_caldera.value(1)
-relay_acs.value(1)
-relay_primerod.value(1)
-relay_garaje.value(1)
-relay_gen1.value(1)
-relay_gen2.value(1)
-relay_gen3.value(1)
-relay_gen4.value(1)
+Switch(mlha, "caldera_status", "Estado de la caldera", Pin(relay_caldera_pin, Pin.OUT), active_low=True)
+Switch(mlha, "acs_status", "Estado del ACS", Pin(relay_acs_pin, Pin.OUT), active_low=True)
+Switch(mlha, "primerod_status", "Estado del Primero D", Pin(relay_primerod_pin, Pin.OUT), active_low=True)
+Switch(mlha, "garaje_status", "Estado del Garaje", Pin(relay_garaje_pin, Pin.OUT), active_low=True)
 
-# Initialize PIR sensor
+# Initialize PIR sensor, it has its own state topic
 print("Initializing PIR sensor")
 pir_sensor = Pin(pir_pin, Pin.IN)
+mlha.publish_config("cuadra_motion", "Movimiento en la cuadra", "binary_sensor", "motion", state_topic = "/motion", expire_after = 60)
 
-# Subscribe to topics
-print("New session being set up")
-mlha.subscribe("switch/toggle/caldera_status")
-mlha.subscribe("switch/toggle/acs_status")
-mlha.subscribe("switch/toggle/primerod_status")
-mlha.subscribe("switch/toggle/garaje_status")
-mlha.subscribe("switch/toggle/gen1_status")
-mlha.subscribe("switch/toggle/gen2_status")
-mlha.subscribe("switch/toggle/gen3_status")
-mlha.subscribe("switch/toggle/gen4_status")
+BinarySensor(mlha, "mltemp_connection", "MLTemp Connection", lambda: True, "connectivity")
+Switch(mlha, "gen1_status", "Estado del rele gen 1", Pin(relay_gen1_pin, Pin.OUT), active_low=True)
+Switch(mlha, "gen2_status", "Estado del rele gen 2", Pin(relay_gen2_pin, Pin.OUT), active_low=True)
+Switch(mlha, "gen3_status", "Estado del rele gen 3", Pin(relay_gen3_pin, Pin.OUT), active_low=True)
+Switch(mlha, "gen4_status", "Estado del rele gen 4", Pin(relay_gen4_pin, Pin.OUT), active_low=True)
 print("Connected to MQTT broker and subscribed to topics")
 
-# Publish config for sensors
-print("Publishing config to Homeassistant")
-setup_config() # Publishes the config for Homeassistant
-
 print("Starting values read and publish timer")
 print("Initialization complete, free memory: " + str(gc.mem_free()))
 print("Ready to send/receive data")
 mlha.publish("system/status", "online", retain=True)
 
-# Main loop
-last_update = 0
+# Main loop, the scheduler sleeps until the next task is due or a MQTT message arrives
 last_pir_value = 2 # Force first check and publish
-while True:
-    try:
-        mlha.check_mqtt_msg()
-        # Check PIR sensor
-        if pir_sensor.value() != last_pir_value or time.ticks_diff(time.ticks_ms(), last_update) > 30000:
-            last_pir_value = pir_sensor.value()
-            if last_pir_value == 1:
-                print("Motion detected")
-                mlha.publish("motion/state", "True")
-            else:
-                print("Motion stopped")
-                mlha.publish("motion/state", "False")
-        # Send data to broker every 15 seconds
-        if time.ticks_diff(time.ticks_ms(), last_update) > 15000: # 15 seconds
-            last_update = time.ticks_ms()
-            read_and_publish()
-        time.sleep_ms(250)
-    except Exception as ex:
-        print("error: " + str(ex))
-        time.sleep_ms(250)
-        machine.reset()
+last_pir_publish = 0
+
+def check_pir():
+    global last_pir_value, last_pir_publish
+    if pir_sensor.value() != last_pir_value or time.ticks_diff(time.ticks_ms(), last_pir_publish) > 30000:
+        last_pir_publish = time.ticks_ms()
+        last_pir_value = pir_sensor.value()
+        if last_pir_value == 1:
+            print("Motion detected")
+            mlha.publish("motion/state", "True")
+        else:
+            print("Motion stopped")
+            mlha.publish("motion/state", "False")
+
+# Start a temperature conversion every 15 seconds, the readings are collected once it is done
+def start_conversion():
+    temperatures.start()
+    sched.after(temperatures.time_left(), collect_temperatures)
+
+def collect_temperatures():
+    if temperatures.poll():
+        read_and_publish()
+    else:
+        sched.after(temperatures.time_left(), collect_temperatures)
+
+sched = Scheduler(mlha)
+sched.every(250, check_pir)
+sched.every(15000, start_conversion)
+try:
+    sched.run()
+except Exception as ex:
+    print("error: " + str(ex))
+    time.sleep_ms(250)
+    machine.reset()
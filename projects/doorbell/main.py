@@ -1,6 +1,10 @@
 import json
 from secrets import wifi_SSID, wifi_password, mqtt_server, mqtt_port, mqtt_user, mqtt_password
 from makerlab.mlha import MLHA 
+from makerlab.mlsched import Scheduler
+from makerlab.mlinput import InputEvents
+import machine
+import micropython
 from machine import Pin
 import time
 import gc
@@ -26,47 +30,56 @@ def setup_config():
     mlha.publish_config("doorbell", "Doorbell", "binary_sensor", "occupancy", expire_after = 140)
     mlha.publish_config("mldoorbell_connection", "MLDoorBell Connection", "binary_sensor", "connectivity", expire_after = 140)
 
-def button_pressed(pin=None):
-    if mlha is None:
-        push_button.irq(trigger=Pin.IRQ_RISING, handler=None)
-    if false_protection_check() == False:
-        print("False press detected")
-        return
-    print("Bell is ringing")
-    # Publish status
-    if mlha is not None:
-        mlha.publish_status(parse_message(True))
-    # Start bell
-    ring_bell()
-    # Delay for 1 second
-    time.sleep(1)
-    # Stop bell
-    bell_relay.value(0)
-    if mlha is not None:
-        mlha.publish_status(parse_message())
-    else:
-        push_button.irq(trigger=Pin.IRQ_RISING, handler=button_pressed)
+# Until the network is up there is no main loop, a press rings the bell right away from the main
+# context through micropython.schedule, never inside the interrupt handler
+def boot_pressed(pin):
+    try:
+        micropython.schedule(boot_ring, None)
+    except RuntimeError:
+        pass # Schedule queue full, a ring is already pending
 
-def ring_bell():
+def boot_ring(_):
+    if push_button.value() == 0:
+        return # False press
     for i in range(0, 7):
         bell_relay.value(1)
         time.sleep_ms(100 * i)
         bell_relay.value(0)
         time.sleep_ms(100 * i)
 
-# False press check, check if the button is being pressed constantly for 0.150 seconds
-def false_protection_check():
-    start_time = time.ticks_ms()
-    while (time.ticks_diff(time.ticks_ms(), start_time) < 150):
-        if push_button.value() == 0:
-            return False
-    return True
+def button_pressed():
+    if ringing >= 0:
+        return
+    print("Bell is ringing")
+    # Publish status
+    mlha.publish_status(parse_message(True))
+    ring_bell()
+
+# Rings 7 times with growing pauses, driven by the scheduler so the loop keeps running
+ringing = -1 # Step of the ring sequence, -1 when idle
+def ring_bell():
+    global ringing
+    ringing += 1
+    i = ringing >> 1
+    if i == 7:
+        # Delay for 1 second before reporting the bell is idle, presses are still ignored meanwhile
+        sched.after(1000, bell_done)
+        return
+    bell_relay.value(1 - (ringing & 1))
+    sched.after(100 * i, ring_bell)
+
+def bell_done():
+    global ringing
+    ringing = -1
+    # Stop bell
+    bell_relay.value(0)
+    mlha.publish_status(parse_message())
 
 # Main =============================================
 # Initialise push button and its interrupt
 print("Initializing push button")
 push_button = Pin(button_pin, Pin.IN, Pin.PULL_DOWN)
-push_button.irq(trigger=Pin.IRQ_RISING, handler=button_pressed)
+push_button.irq(trigger=Pin.IRQ_RISING, handler=boot_pressed)
 
 # Initialise Relay
 print("Initializing relay")
@@ -89,24 +102,21 @@ mlha.publish("system/status", "online", retain=True)
 mlha.publish_status(parse_message())
 print("Initialization complete, free memory: " + str(gc.mem_free()))
 print("Ready to send/receive data")
-# Disable interrupt
-push_button.irq(trigger=Pin.IRQ_RISING, handler=None)
+# From now on the interrupt only queues edges, presses are debounced in the main loop.
+# A press has to last 150 ms to count, to filter out false presses
+inputs = InputEvents()
+inputs.button(push_button, on_press=button_pressed, debounce=150)
 
 # Main loop
-last_update = 0
-while True:
-    try:
-        if time.ticks_diff(time.ticks_ms(), last_update) > 120000: # 2 minutes
-            mlha.check_mqtt_msg()
-            last_update = time.ticks_ms()
-            mlha.publish_status(parse_message())
-            mlha.update_temp_sensor()
-        # Make sure relay is off
-        if bell_relay.value() == 1:
-            bell_relay.value(0)
-        # Check if button is pressed
-        if push_button.value() == 1:
-            button_pressed()
-    except Exception as ex:
-        print("error: " + str(ex))
-        machine.reset()
+def publish_status():
+    mlha.publish_status(parse_message())
+    mlha.update_temp_sensor()
+
+sched = Scheduler(mlha)
+sched.every(120000, publish_status, delay=120000) # 2 minutes
+inputs.schedule(sched)
+try:
+    sched.run()
+except Exception as ex:
+    print("error: " + str(ex))
+    machine.reset()
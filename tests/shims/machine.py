@@ -0,0 +1,71 @@
+# Stand-in for the MicroPython machine module, just enough for makerlab on CPython
+PWRON_RESET = 1
+WDT_RESET = 3
+reset_causes = [PWRON_RESET]
+
+
+class Reset(Exception):
+    pass
+
+
+def reset():
+    raise Reset()
+
+
+def reset_cause():
+    return reset_causes[0]
+
+
+def unique_id():
+    return b"\x01\x02\x03\x04"
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=-1, pull=-1):
+        self.level = 0
+        self.handler = None
+
+    def value(self, level=None):
+        if level is None:
+            return self.level
+        self.level = level
+
+    def on(self):
+        self.level = 1
+
+    def off(self):
+        self.level = 0
+
+    def toggle(self):
+        self.level ^= 1
+
+    def irq(self, trigger=0, handler=None):
+        self.handler = handler
+
+
+class Timer:
+    PERIODIC = 1
+
+    def __init__(self, id=-1):
+        pass
+
+    def init(self, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+
+class ADC:
+    def __init__(self, id):
+        pass
+
+    def read_u16(self):
+        return 14000
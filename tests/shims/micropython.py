@@ -0,0 +1,3 @@
+# Stand-in for the micropython module, scheduled callbacks run at once
+def schedule(fn, arg):
+    fn(arg)
@@ -0,0 +1,28 @@
+# Stand-in for the MicroPython network module, the link is always up
+STA_IF = 0
+
+
+class WLAN:
+    def __init__(self, interface):
+        pass
+
+    def active(self, flag=None):
+        return True
+
+    def connect(self, ssid, password, bssid=None):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def status(self):
+        return 3
+
+    def ifconfig(self, config=None):
+        return ("192.168.1.5", "255.255.255.0", "192.168.1.1", "1.1.1.1")
+
+    def config(self, name):
+        return b"\xaa\xbb\xcc\xdd\xee\xff"
+
+    def scan(self):
+        return []
@@ -0,0 +1,165 @@
+# Shared setup for the tests. Puts the CPython stand-ins for the MicroPython modules
+# (bench/shims, tests/shims) and lib/ on the path, and provides a broker socket that parses
+# what the client writes and answers it like a broker would.
+import os
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(_HERE, "shims"), os.path.join(_HERE, "..", "bench", "shims"), os.path.join(_HERE, "..", "lib")]
+
+import utime
+
+# makerlab uses the MicroPython additions to the time module
+time.ticks_ms = utime.ticks_ms
+time.ticks_us = utime.ticks_us
+time.ticks_add = utime.ticks_add
+time.ticks_diff = utime.ticks_diff
+time.sleep_ms = lambda ms: None
+
+from umqtt import simple2
+from umqtt.rxbuf import RxBuffer
+
+
+class BrokerSocket:
+    def __init__(self, ack=True):
+        self.ack = ack # Answer QoS 1 publishes with a PUBACK
+        self.broken = False # Writes fail as if the connection had dropped
+        self.inq = bytearray()
+        self.rx = RxBuffer()
+        self.published = [] # (topic, msg, retain, qos)
+
+    def write(self, data, length=-1):
+        if self.broken:
+            raise OSError(104)
+        data = bytes(data if length < 0 else data[:length])
+        self.rx.feed(data)
+        while True:
+            packet = self.rx.packet()
+            if packet is None:
+                break
+            kind, size, head = packet
+            start = self.rx.start + head
+            self.handle(kind, bytes(self.rx.mv[start:start + size]))
+            self.rx.consume(head + size)
+        return len(data)
+
+    def handle(self, kind, body):
+        if kind == 0x10:
+            self.inq += b"\x20\x02\x00\x00"
+        elif kind == 0x82:
+            # Grant every filter the QoS it asked for
+            codes = bytearray()
+            i = 2
+            while i < len(body):
+                i += 2 + (body[i] << 8 | body[i + 1])
+                codes.append(body[i])
+                i += 1
+            self.inq += bytes((0x90, 2 + len(codes))) + body[:2] + codes
+        elif kind & 0xF0 == 0x30:
+            qos = kind >> 1 & 3
+            size = body[0] << 8 | body[1]
+            self.published.append((body[2:2 + size].decode(), body[2 + size + (2 if qos else 0):], bool(kind & 1), qos))
+            if qos and self.ack:
+                self.inq += b"\x40\x02" + body[2 + size:4 + size]
+        elif kind == 0xC0:
+            self.inq += b"\xd0\x00"
+
+    def readinto(self, mv):
+        if not self.inq:
+            return None
+        n = min(len(mv), len(self.inq))
+        mv[:n] = self.inq[:n]
+        del self.inq[:n]
+        return n
+
+    def setblocking(self, flag):
+        pass
+
+    def connect(self, address):
+        pass
+
+    def close(self):
+        pass
+
+
+sockets = [] # Every socket the clients opened, the current one last
+
+
+class _SocketModule:
+    @staticmethod
+    def getaddrinfo(host, port):
+        return [(0, 0, 0, "", (host, port))]
+
+    @staticmethod
+    def socket(*args):
+        sockets.append(BrokerSocket())
+        return sockets[-1]
+
+
+class _Poller:
+    def register(self, *args):
+        pass
+
+    def unregister(self, *args):
+        pass
+
+    def poll(self, timeout=-1):
+        return [(None, 4)]
+
+
+class _SelectModule:
+    POLLIN = 1
+    POLLOUT = 4
+    POLLERR = 8
+    POLLHUP = 16
+    poll = _Poller
+
+
+simple2.socket = _SocketModule
+simple2.uselect = _SelectModule
+
+
+from makerlab import mlha
+
+
+# MLHA without the 5 s LED check, connected to a BrokerSocket
+class Board(mlha.MLHA):
+    def setup(self):
+        self.connectWifi()
+        self.connectMQTT()
+
+
+# Stand-in for asyncio.open_connection, for umqtt.aio. Both ends of the stream talk to a
+# BrokerSocket, whatever the broker answers is handed to the client's reader
+class BrokerStream:
+    def __init__(self):
+        import asyncio
+        self.sock = BrokerSocket()
+        self.inq = asyncio.Queue()
+
+    def write(self, data):
+        self.sock.write(data)
+        if self.sock.inq:
+            self.inq.put_nowait(bytes(self.sock.inq))
+            self.sock.inq.clear()
+
+    async def drain(self):
+        pass
+
+    async def read(self, n):
+        return await self.inq.get()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+streams = [] # Every stream the asyncio clients opened, the current one last
+
+
+async def open_connection(host, port, **kwargs):
+    streams.append(BrokerStream())
+    return streams[-1], streams[-1]
@@ -0,0 +1,82 @@
+# Acknowledgements in the asyncio flavour of MLHA
+import asyncio
+import os
+import tempfile
+import unittest
+
+import support
+import machine
+from makerlab import mlha_async
+from umqtt import aio
+
+
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        mlha_async.MLHA.CONFIG_HASHES_FILE = os.path.join(self.dir.name, "discovery.json")
+        aio.asyncio.open_connection = support.open_connection
+
+    def tearDown(self):
+        aio.asyncio.open_connection = asyncio.open_connection
+        self.dir.cleanup()
+
+    def test_puback_reaches_the_bookkeeping(self):
+        async def main():
+            board = mlha_async.MLHA("ssid", "password", "broker")
+            delivered = []
+            board.set_delivery_callback(lambda topic, latency: delivered.append(topic))
+            await board.connectMQTT()
+            board.publish_config("value", "Value")
+            topic = "homeassistant/sensor/" + board.pico_id + "/value/config"
+            for _ in range(10):
+                await asyncio.sleep(0)
+            await board.mqtt.disconnect()
+            self.assertEqual(board.delivered, 1)
+            self.assertEqual(delivered, [topic])
+            self.assertEqual(list(board.config_hashes), [topic])
+            self.assertEqual(board.pending_hashes, {})
+            self.assertEqual(board.mqtt.pub_acks, {})
+
+        asyncio.run(main())
+
+    def test_persisted_messages_are_replayed_and_marked_done(self):
+        persist_dir = os.path.join(self.dir.name, "queue")
+        os.mkdir(persist_dir)
+        # Published while offline, then the board resets
+        board = mlha_async.MLHA("ssid", "password", "broker", persist_dir=persist_dir)
+        board.publish("event", "1", persist=True)
+        board.persist.flush(True)
+
+        async def main():
+            board = mlha_async.MLHA("ssid", "password", "broker", persist_dir=persist_dir)
+            await board.connectMQTT()
+            board.replay_persistent()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            await board.mqtt.disconnect()
+            board.persist.flush(True)
+            topic = board.pico_id + "/event"
+            self.assertEqual([p[:2] for p in support.streams[-1].sock.published], [(topic, b"1")])
+            self.assertEqual(board.persist_keys, {})
+
+        asyncio.run(main())
+        replayed = []
+        board = mlha_async.MLHA("ssid", "password", "broker", persist_dir=persist_dir)
+        board.persist.replay(lambda *message: replayed.append(message))
+        self.assertEqual(replayed, [])
+
+    def test_reset_flushes_the_flash_queue(self):
+        persist_dir = os.path.join(self.dir.name, "queue")
+        os.mkdir(persist_dir)
+        board = mlha_async.MLHA("ssid", "password", "broker", persist_dir=persist_dir)
+        board.publish("event", "1", persist=True)
+        board.error_count = 11
+        with self.assertRaises(machine.Reset):
+            asyncio.run(board.watchdog_task())
+        replayed = []
+        mlha_async.MLHA("ssid", "password", "broker", persist_dir=persist_dir).persist.replay(lambda *message: replayed.append(message))
+        self.assertEqual(len(replayed), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# Discovery of more entities than the send queue holds, through the QoS 1 in-flight window
+import os
+import tempfile
+import unittest
+
+import support
+import utime
+from makerlab.mlentity import Sensor
+from support import Board
+
+
+class DiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        Board.CONFIG_HASHES_FILE = os.path.join(self.dir.name, "discovery.json")
+        Board.WIFI_CACHE_FILE = os.path.join(self.dir.name, "wifi.json")
+        utime._now[0] = 1000
+
+    def tearDown(self):
+        utime._now[0] = None
+        self.dir.cleanup()
+
+    def run_loop(self, board, times=20):
+        for _ in range(times):
+            utime._now[0] += 100
+            board.check_mqtt_msg()
+
+    def configs(self, sock):
+        return [topic for topic, msg, retain, qos in sock.published if topic.endswith("/config") and msg]
+
+    def test_more_entities_than_the_queue(self):
+        board = Board("ssid", "password", "broker")
+        count = board.mqtt.MSG_QUEUE_MAX + 8
+        for i in range(count):
+            Sensor(board, "s%d" % i, "Sensor %d" % i)
+        self.run_loop(board)
+        sock = support.sockets[-1]
+        topics = ["homeassistant/sensor/%s/s%d/config" % (board.pico_id, i) for i in range(count)]
+        self.assertEqual(self.configs(sock), topics)
+        self.assertEqual(sorted(board.config_hashes), sorted(topics))
+        self.assertEqual(board.pending_configs, [])
+        self.assertEqual(board.mqtt.dropped, 0)
+        # Nothing changed, a second boot sends none of them
+        board = Board("ssid", "password", "broker")
+        for i in range(count):
+            Sensor(board, "s%d" % i, "Sensor %d" % i)
+        self.run_loop(board)
+        self.assertEqual(self.configs(support.sockets[-1]), [])
+
+    def test_held_back_while_disconnected(self):
+        board = Board("ssid", "password", "broker")
+        board.mqtt.conn_issue = (OSError(), 2)
+        Sensor(board, "s0", "Sensor 0")
+        self.assertEqual(len(board.pending_configs), 1)
+        self.assertEqual(len(board.mqtt.msg_to_send), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# Button processing driven by the interrupt instead of a fixed polling period
+import time
+import unittest
+
+import support
+import utime
+from machine import Pin
+from makerlab.mlinput import InputEvents
+from makerlab.mlsched import Scheduler
+
+
+class InputEventsTest(unittest.TestCase):
+    def setUp(self):
+        utime._now[0] = 1000
+        self.sleep_ms = time.sleep_ms
+        time.sleep_ms = self.advance
+        self.events = []
+        self.inputs = InputEvents()
+        self.pin = Pin(14)
+        self.inputs.button(self.pin, on_press=lambda: self.events.append(("press", utime._now[0])),
+                           on_long_press=lambda: self.events.append(("long", utime._now[0])), debounce=150)
+        self.sched = Scheduler()
+        self.inputs.schedule(self.sched)
+
+    def tearDown(self):
+        time.sleep_ms = self.sleep_ms
+        utime._now[0] = None
+
+    def advance(self, ms):
+        utime._now[0] += ms
+
+    def run_for(self, ms):
+        end = utime._now[0] + ms
+        while utime._now[0] < end:
+            self.sched.run_once()
+
+    def edge(self, level):
+        self.pin.value(level)
+        self.pin.handler(self.pin)
+
+    def test_idle_does_not_wake(self):
+        self.run_for(10000)
+        # The initial run, then only the scheduler's default 1 s sleep
+        self.assertEqual(self.sched.runs, 1)
+        self.assertEqual(self.sched.wakeups, 10)
+        self.assertEqual(self.inputs.due(), -1)
+
+    def test_press_and_long_press_on_time(self):
+        self.run_for(500)
+        start = utime._now[0]
+        self.edge(1)
+        self.run_for(2000)
+        self.assertEqual(self.events, [("press", start + 150), ("long", start + 1000)])
+        runs = self.sched.runs
+        self.edge(0)
+        self.run_for(10000)
+        # Released and settled, nothing is armed any more
+        self.assertIsNone(self.inputs.task)
+        self.assertLessEqual(self.sched.runs - runs, 3)
+
+    def test_bounce_is_ignored(self):
+        self.run_for(500)
+        self.edge(1)
+        utime._now[0] += 20
+        self.edge(0)
+        self.run_for(1000)
+        self.assertEqual(self.events, [])
+        self.assertIsNone(self.inputs.task)
+
+
+if __name__ == "__main__":
+    unittest.main()
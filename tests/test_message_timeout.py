@@ -0,0 +1,112 @@
+# Pending-ack deadlines of umqtt.simple2 across the 30-bit ticks_ms wraparound.
+# Runs on CPython with the shims from bench/shims: python -m unittest discover tests
+import os
+import sys
+import unittest
+
+_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(_ROOT, "bench", "shims"), os.path.join(_ROOT, "lib")]
+
+import utime
+from umqtt import simple2
+
+WRAP = 1 << 30
+
+
+class MessageTimeoutTest(unittest.TestCase):
+    def tearDown(self):
+        utime._now[0] = None
+
+    def client(self, message_timeout=10):
+        client = simple2.MQTTClient("pico", "broker", message_timeout=message_timeout)
+        self.expired = []
+        client.cbstat = lambda pid, status: self.expired.append((pid, status))
+        return client
+
+    def at(self, t):
+        utime._now[0] = t
+
+    def check_expiry(self, start):
+        self.at(start)
+        client = self.client()
+        for pid in range(1, 6):
+            # Deadlines at start + 10000, 11000, ... 14000
+            self.at(start + (pid - 1) * 1000)
+            client._track(pid)
+        # Acked before its deadline, must not time out
+        client.rcv_pids.pop(3)
+        self.at(start + 9999)
+        client._message_timeout()
+        self.assertEqual(self.expired, [])
+        self.at(start + 10000)
+        client._message_timeout()
+        self.assertEqual(self.expired, [(1, 0)])
+        self.at(start + 12500)
+        client._message_timeout()
+        self.assertEqual(self.expired, [(1, 0), (2, 0)])
+        self.at(start + 20000)
+        client._message_timeout()
+        self.assertEqual(self.expired, [(1, 0), (2, 0), (4, 0), (5, 0)])
+        self.assertEqual(client.rcv_pids, {})
+        self.assertEqual(client.deadlines, [])
+
+    def test_just_before_wrap(self):
+        self.check_expiry(WRAP - 3000)
+
+    def test_deadlines_straddle_wrap(self):
+        self.check_expiry(WRAP - 12000)
+
+    def test_at_zero(self):
+        self.check_expiry(0)
+
+    def test_at_signed_midpoint(self):
+        self.check_expiry(1 << 29)
+        self.check_expiry((1 << 29) - 12000)
+
+    def test_nothing_pending(self):
+        self.at(WRAP - 1)
+        client = self.client()
+        client._message_timeout()
+        self.assertEqual(self.expired, [])
+
+    def test_rekey_keeps_deadline(self):
+        # A deadline ~4.6 days out, the epoch gets older than 2**28 ms on the way and is re-keyed
+        start = WRAP - 5000
+        timeout = 400000
+        self.at(start)
+        client = self.client(timeout)
+        client._track(1)
+        epoch = client.epoch
+        deadline = start + timeout * 1000
+        t = start
+        while not self.expired:
+            t += 10000000
+            self.at(t)
+            client._message_timeout()
+        self.assertEqual(self.expired, [(1, 0)])
+        self.assertGreaterEqual(t, deadline)
+        self.assertLess(t - deadline, 10000000)
+        self.assertNotEqual(client.epoch, epoch)
+
+    def test_rekey_with_early_deadline_left(self):
+        # An acked entry with an old epoch next to a fresh one, both survive the re-key in order
+        self.at(0)
+        client = self.client(400000)
+        client._track(1)
+        client.rcv_pids.pop(1)
+        for k in range(1, 30):
+            self.at(k * 10000000)
+            client._message_timeout()
+        client.message_timeout = 10
+        client._track(2)
+        now = 29 * 10000000
+        self.at(now + 9999)
+        client._message_timeout()
+        self.assertEqual(self.expired, [])
+        self.at(now + 10000)
+        client._message_timeout()
+        self.assertEqual(self.expired, [(2, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
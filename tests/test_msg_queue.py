@@ -0,0 +1,107 @@
+# robust2's send queue: tombstones, the QoS 1 count and the order of requeued messages
+import unittest
+
+import support
+import utime
+from umqtt import robust2
+
+
+def topics(queue):
+    result = []
+    for i in range(queue.n):
+        entry = queue.get(i)
+        if entry[0] is not None:
+            result.append(entry[0])
+    return result
+
+
+class MsgQueueTest(unittest.TestCase):
+    def test_remove_leaves_tombstone(self):
+        queue = robust2.MsgQueue(4)
+        queue.push("a", "1")
+        queue.push("b", "1", True)
+        queue.push("c", "1", qos=1)
+        self.assertTrue(queue.remove("b", True))
+        self.assertEqual(len(queue), 2)
+        self.assertEqual(topics(queue), ["a", "c"])
+        queue.pop()
+        # The tombstone after "a" is skipped, "c" is next
+        self.assertEqual(queue.topics[queue.peek()], "c")
+        self.assertEqual(len(queue), 1)
+
+    def test_remove_needs_retain_or_coalesce(self):
+        queue = robust2.MsgQueue(4)
+        queue.push("a", "1")
+        self.assertFalse(queue.remove("a"))
+        self.assertTrue(queue.push("b", "1", coalesce=True))
+        self.assertTrue(queue.remove("b", coalesce=True))
+        self.assertEqual(len(queue), 1)
+
+    def test_full_ring_reuses_tombstones(self):
+        queue = robust2.MsgQueue(3)
+        queue.push("a", "1")
+        queue.push("b", "1", True)
+        queue.push("c", "1")
+        self.assertFalse(queue.push("d", "1"))
+        queue.remove("b", True)
+        self.assertTrue(queue.push("d", "1"))
+        self.assertEqual(topics(queue), ["a", "c", "d"])
+        self.assertTrue(queue.push_front("e", "1") is False)
+
+    def test_qos1_count(self):
+        queue = robust2.MsgQueue(4)
+        self.assertFalse(queue.has_qos1())
+        queue.push("a", "1", True, 1)
+        queue.push("b", "1", True, 1)
+        queue.push("c", "1", True)
+        self.assertTrue(queue.has_qos1())
+        queue.remove("b", True)
+        queue.pop()
+        self.assertFalse(queue.has_qos1())
+        # Replacing a QoS 0 entry with a QoS 1 one counts it
+        queue.replace("c", "2", True, 1)
+        self.assertTrue(queue.has_qos1())
+        queue.clear()
+        self.assertFalse(queue.has_qos1())
+
+
+class RequeueTest(unittest.TestCase):
+    def tearDown(self):
+        utime._now[0] = None
+
+    def client(self):
+        client = robust2.MQTTClient("pico", "broker", message_timeout=10)
+        client.MSG_QUEUE_MAX = 4
+        client.msg_to_send.resize(4)
+        client.connect()
+        support.sockets[-1].ack = False
+        return client
+
+    def test_timeouts_keep_publish_order(self):
+        utime._now[0] = 1000
+        client = self.client()
+        for i in range(3):
+            client.publish("ev", "m%d" % i, qos=1)
+        client.msg_to_send.push("x", "queued")
+        utime._now[0] += 10000
+        client.check_msg()
+        queued = [client.msg_to_send.get(i)[1] for i in range(len(client.msg_to_send))]
+        self.assertEqual(queued, ["m0", "m1", "m2", "queued"])
+        self.assertEqual(client.dropped, 0)
+
+    def test_full_queue_counts_drops(self):
+        utime._now[0] = 1000
+        client = self.client()
+        for i in range(3):
+            client.publish("ev", "m%d" % i, qos=1)
+        for i in range(3):
+            client.msg_to_send.push("q%d" % i, "1")
+        utime._now[0] += 10000
+        client.check_msg()
+        # Only the first one to be requeued still fits
+        self.assertEqual(client.dropped, 2)
+        self.assertEqual(client.msg_to_send.get(0)[1], "m2")
+
+
+if __name__ == "__main__":
+    unittest.main()
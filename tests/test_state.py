@@ -0,0 +1,50 @@
+# State publishing across a dropped connection
+import os
+import tempfile
+import unittest
+
+import support
+import utime
+from support import Board
+
+
+class StateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        Board.CONFIG_HASHES_FILE = os.path.join(self.dir.name, "discovery.json")
+        Board.WIFI_CACHE_FILE = os.path.join(self.dir.name, "wifi.json")
+        utime._now[0] = 1000
+
+    def tearDown(self):
+        utime._now[0] = None
+        self.dir.cleanup()
+
+    def states(self, sock, board):
+        return [msg for topic, msg, retain, qos in sock.published if topic == board.topic_state]
+
+    def test_change_during_outage_is_sent_after_reconnect(self):
+        board = Board("ssid", "password", "broker")
+        board.publish_config("value", "Value", expire_after=0)
+        board.set_state("value", 1)
+        board.publish_status()
+        first = support.sockets[-1]
+        self.assertEqual(len(self.states(first, board)), 1)
+        first.broken = True
+        board.set_state("value", 2)
+        board.publish_status()
+        self.assertTrue(board.mqtt.conn_issue)
+        for _ in range(10):
+            utime._now[0] += 500
+            board.check_mqtt_msg()
+            # The application keeps publishing the unchanged value
+            board.publish_status()
+        second = support.sockets[-1]
+        self.assertIsNot(second, first)
+        self.assertEqual(board.reconnects, 1)
+        self.assertEqual(len(self.states(second, board)), 1)
+        self.assertIn(b"2", self.states(second, board)[0])
+        self.assertEqual(second.published[0][:2], (board.topic_availability, b"online"))
+
+
+if __name__ == "__main__":
+    unittest.main()